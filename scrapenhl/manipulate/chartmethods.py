@@ -0,0 +1,369 @@
+"""
+Shift charts and head-to-head TOI heatmaps for single games.
+
+Chart geometry is computed from cleaned-up shift intervals (see scrape_game.read_shift_intervals_from_json), not the
+per-second toi grid, so a game is a few hundred rectangles. Rendering uses matplotlib's headless Agg backend across a
+process pool, and games whose chart data hasn't changed since they were last rendered are skipped.
+"""
+
+from scrapenhl.scrape import scrapenhl_globals
+from scrapenhl.scrape import scrape_game
+from scrapenhl.scrape import fileio
+
+### Bump when chart layout or styling changes, so every chart is rendered again
+CHART_VERSION = 1
+POSITION_ORDER = {'G': 0, 'D': 1, 'C': 2, 'L': 3, 'R': 4}
+
+
+def get_chart_folder(season):
+    """
+    Returns the folder charts for this season are saved in
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+
+    Returns
+    --------
+    str
+        SAVE_FOLDER/Season/charts/
+    """
+    return '{0:s}{1:d}/charts/'.format(scrapenhl_globals.SAVE_FOLDER, season)
+
+
+def get_chart_filename(season, game, chart):
+    """
+    Returns the file name of a rendered chart
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    chart : str
+        'shifts' or 'h2h'
+
+    Returns
+    --------
+    str
+        SAVE_FOLDER/Season/charts/Game_chart.png
+    """
+    return '{0:s}{1:d}_{2:s}.png'.format(get_chart_folder(season), game, chart)
+
+
+def get_chart_manifest_filename(season):
+    """
+    Returns the file name of the table of chart data hashes for rendered charts
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+
+    Returns
+    --------
+    str
+        SAVE_FOLDER/Season/charts/manifest.feather
+    """
+    return '{0:s}manifest.feather'.format(get_chart_folder(season))
+
+
+def get_shift_chart_data(season, game):
+    """
+    Computes chart-ready geometry for this game: one bar per shift, plus goal times and period ends.
+
+    Players get one row each, home team on top, ordered by position (G, D, C, L, R) and then by time on ice.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+
+    Returns
+    --------
+    dict
+        'bars' (df with Team, PlayerID, Name, Row, Start, Width), 'h2h' (df of home players by road players, seconds
+        on ice against each other), 'goals' (list of times), 'periodends' (list of times), 'home', 'road', or None if
+        the game has no shifts
+    """
+    import numpy as np
+    import pandas as pd
+
+    gamedata = scrape_game.get_game_json(season, game)
+    homename = gamedata['gameData']['teams']['home']['abbreviation']
+    roadname = gamedata['gameData']['teams']['away']['abbreviation']
+    intervals = scrape_game.read_shift_intervals_from_json(scrape_game.get_shift_json(season, game)['data'],
+                                                           homename, roadname)
+    if intervals is None:
+        return None
+
+    roster = scrape_game.get_game_roster(season, game, gamedata['liveData']['boxscore']['teams'])
+    roster = roster.assign(PlayerID = roster.ID.astype(np.int64)).drop_duplicates(subset = 'PlayerID')
+    intervals = intervals.assign(Width = intervals.End - intervals.Start + 1)
+
+    players = intervals.groupby(['Team', 'PlayerID'], as_index = False).Width.sum()
+    players = players.merge(roster[['PlayerID', 'Name', 'Pos']], how = 'left', on = 'PlayerID')
+    players = players.assign(HomeFirst = (players.Team != homename).astype(int),
+                             PosOrder = players.Pos.map(POSITION_ORDER).fillna(len(POSITION_ORDER)))
+    players = players.sort_values(by = ['HomeFirst', 'PosOrder', 'Width'], ascending = [True, True, False])
+    players = players.assign(Row = np.arange(len(players.index)), Name = players.Name.fillna(''))
+
+    bars = intervals.merge(players[['Team', 'PlayerID', 'Name', 'Row']], how = 'left', on = ['Team', 'PlayerID'])
+    bars = bars[['Team', 'PlayerID', 'Name', 'Row', 'Start', 'Width']].sort_values(by = ['Row', 'Start'])
+
+    ### Seconds each home player spent against each road player, from pairwise interval overlaps
+    home = intervals[intervals.Team == homename]
+    road = intervals[intervals.Team == roadname]
+    overlap = np.minimum(home.End.to_numpy()[:, np.newaxis], road.End.to_numpy()[np.newaxis, :]) - \
+              np.maximum(home.Start.to_numpy()[:, np.newaxis], road.Start.to_numpy()[np.newaxis, :]) + 1
+    overlap = np.maximum(overlap, 0)
+    h2h = pd.DataFrame({'HomeID': np.repeat(home.PlayerID.to_numpy(), len(road.index)),
+                        'RoadID': np.tile(road.PlayerID.to_numpy(), len(home.index)),
+                        'TOI': overlap.ravel()})
+    h2h = h2h.pivot_table(index = 'HomeID', columns = 'RoadID', values = 'TOI', aggfunc = 'sum', fill_value = 0)
+    ### Same player order as the shift chart
+    h2h = h2h.reindex(index = players.PlayerID[players.Team == homename],
+                      columns = players.PlayerID[players.Team == roadname], fill_value = 0)
+
+    goals = scrape_game.read_goals_from_json(gamedata['liveData']['plays']['allPlays'])
+    periodends = list(range(1200, int(intervals.End.max()) + 1, 1200))
+
+    return {'bars': bars.reset_index(drop = True), 'h2h': h2h, 'goals': [int(t) for t in goals.Time],
+            'periodends': periodends, 'home': homename, 'road': roadname,
+            'names': dict(zip(players.PlayerID, players.Name))}
+
+
+def get_chart_data_hash(data):
+    """
+    Returns a hash of a game's chart data, used to skip rendering when nothing has changed
+
+    Parameters
+    -----------
+    data : dict
+        The result of get_shift_chart_data
+
+    Returns
+    --------
+    str
+        Hex hash
+    """
+    import hashlib
+    import pandas as pd
+    md5 = hashlib.md5(str(CHART_VERSION).encode('utf-8'))
+    md5.update(pd.util.hash_pandas_object(data['bars'], index = False).to_numpy().tobytes())
+    md5.update(data['h2h'].to_numpy().tobytes())
+    md5.update(repr((data['goals'], data['periodends'], data['home'], data['road'])).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def render_shift_chart(data, filename):
+    """
+    Draws a shift chart to a png file. All shifts are drawn as a single collection, which is much faster than one
+    artist per shift.
+
+    Parameters
+    -----------
+    data : dict
+        The result of get_shift_chart_data
+    filename : str
+        The file to save to
+    """
+    import numpy as np
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PolyCollection
+
+    bars = data['bars']
+    x0 = bars.Start.to_numpy()
+    x1 = x0 + bars.Width.to_numpy()
+    y0 = bars.Row.to_numpy() - 0.4
+    y1 = y0 + 0.8
+    verts = np.stack([np.column_stack([x0, y0]), np.column_stack([x1, y0]),
+                      np.column_stack([x1, y1]), np.column_stack([x0, y1])], axis = 1)
+    colors = np.where(bars.Team == data['home'], 'tab:blue', 'tab:red')
+
+    numrows = int(bars.Row.max()) + 1
+    fig = Figure(figsize = (12, max(4, 0.25 * numrows)))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.add_collection(PolyCollection(verts, facecolors = colors, edgecolors = 'none'))
+    for t in data['periodends']:
+        ax.axvline(t, color = 'black', linewidth = 0.8)
+    for t in data['goals']:
+        ax.axvline(t, color = 'gray', linewidth = 0.8, linestyle = '--')
+
+    rows = bars.drop_duplicates(subset = 'Row').sort_values(by = 'Row')
+    ax.set_yticks(rows.Row.to_numpy())
+    ax.set_yticklabels(['{0:s} {1:s}'.format(t, n) for t, n in zip(rows.Team, rows.Name)], fontsize = 6)
+    ax.set_xlim(0, max(x1.max(), 3600))
+    ax.set_ylim(numrows - 0.5, -0.5)
+    ax.set_xticks(range(0, int(ax.get_xlim()[1]) + 1, 600))
+    ax.set_xticklabels([t // 60 for t in range(0, int(ax.get_xlim()[1]) + 1, 600)])
+    ax.set_xlabel('Minute')
+    ax.set_title('{0:s} at {1:s}'.format(data['road'], data['home']))
+    fig.tight_layout()
+    ### Written crash-safely, so a failed render never leaves a truncated png that _render_game would then skip
+    fileio.atomic_write(filename, lambda tmpname: fig.savefig(tmpname, format = 'png', dpi = 100), lock = False)
+
+
+def render_h2h_heatmap(data, filename):
+    """
+    Draws a head-to-head TOI heatmap (minutes each home player spent against each road player) to a png file.
+
+    Parameters
+    -----------
+    data : dict
+        The result of get_shift_chart_data
+    filename : str
+        The file to save to
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    h2h = data['h2h']
+    fig = Figure(figsize = (10, 9))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    image = ax.imshow(h2h.to_numpy() / 60, cmap = 'viridis', aspect = 'auto')
+    ax.set_yticks(range(len(h2h.index)))
+    ax.set_yticklabels([data['names'].get(p, '') for p in h2h.index], fontsize = 6)
+    ax.set_xticks(range(len(h2h.columns)))
+    ax.set_xticklabels([data['names'].get(p, '') for p in h2h.columns], fontsize = 6, rotation = 90)
+    ax.set_ylabel(data['home'])
+    ax.set_xlabel(data['road'])
+    fig.colorbar(image, ax = ax, label = 'Minutes')
+    fig.tight_layout()
+    fileio.atomic_write(filename, lambda tmpname: fig.savefig(tmpname, format = 'png', dpi = 100), lock = False)
+
+
+def _init_render_worker():
+    """
+    Sets the headless backend in each worker process
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render_game(task):
+    """
+    Computes chart data for one game and renders its charts if the data changed. Runs in a worker process.
+
+    Parameters
+    -----------
+    task : tuple
+        (season, game, hash of the data last rendered or None, force_overwrite)
+
+    Returns
+    --------
+    tuple
+        (game, hash of the chart data or None if the game has no shifts, whether charts were rendered)
+    """
+    import os.path
+    season, game, oldhash, force_overwrite = task
+    try:
+        data = get_shift_chart_data(season, game)
+    except Exception as e:
+        print('Error making chart data for', season, game, e)
+        return game, None, False
+    if data is None:
+        return game, None, False
+
+    newhash = get_chart_data_hash(data)
+    filenames = {chart: get_chart_filename(season, game, chart) for chart in ('shifts', 'h2h')}
+    if not force_overwrite and newhash == oldhash and all(os.path.exists(f) for f in filenames.values()):
+        return game, newhash, False
+
+    render_shift_chart(data, filenames['shifts'])
+    render_h2h_heatmap(data, filenames['h2h'])
+    return game, newhash, True
+
+
+def render_season_charts(season, games = None, processes = None, force_overwrite = False):
+    """
+    Renders shift charts and head-to-head heatmaps for the specified games, in parallel.
+
+    Games whose chart data is unchanged since they were last rendered are skipped.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    games : iterable of ints or None
+        The game ids. If None, all games in the season's game log.
+    processes : int or None
+        Number of worker processes. None uses one per CPU.
+    force_overwrite : bool
+        If True, renders every game even if unchanged.
+
+    Returns
+    --------
+    int
+        The number of games rendered
+    """
+    import os
+    import multiprocessing
+    import pandas as pd
+
+    if games is None:
+        gamelog = scrapenhl_globals.BASIC_GAMELOG
+        games = gamelog.Game[gamelog.Season == season]
+    games = sorted({int(g) for g in games})
+
+    os.makedirs(get_chart_folder(season), exist_ok = True)
+    manifestfile = get_chart_manifest_filename(season)
+    if os.path.exists(manifestfile):
+        manifest = fileio.read_feather(manifestfile)
+    else:
+        manifest = pd.DataFrame({'Game': pd.Series([], dtype = 'int64'), 'Hash': pd.Series([], dtype = object)})
+    oldhashes = dict(zip(manifest.Game, manifest.Hash))
+
+    tasks = [(season, game, oldhashes.get(game), force_overwrite) for game in games]
+    with multiprocessing.Pool(processes, initializer = _init_render_worker) as pool:
+        results = list(pool.imap_unordered(_render_game, tasks, chunksize = 4))
+
+    ### Only this process writes the manifest, so workers never conflict
+    for game, newhash, _ in results:
+        if newhash is not None:
+            oldhashes[game] = newhash
+    manifest = pd.DataFrame({'Game': list(oldhashes.keys()), 'Hash': list(oldhashes.values())}).sort_values('Game')
+    fileio.write_feather(manifest.reset_index(drop = True), manifestfile)
+
+    return sum(1 for _, _, rendered in results if rendered)
+
+
+def benchmark_season_charts(season, games = None, processes = None):
+    """
+    Times rendering every game in a season: once from scratch, then again with nothing changed.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    games : iterable of ints or None
+        The game ids. If None, all games in the season's game log.
+    processes : int or None
+        Number of worker processes. None uses one per CPU.
+
+    Returns
+    --------
+    dict
+        games, full_seconds, games_per_second, unchanged_seconds
+    """
+    import time
+    start = time.perf_counter()
+    numgames = render_season_charts(season, games, processes, force_overwrite = True)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    render_season_charts(season, games, processes)
+    unchanged = time.perf_counter() - start
+
+    results = {'games': numgames, 'full_seconds': full,
+               'games_per_second': numgames / full if full > 0 else 0, 'unchanged_seconds': unchanged}
+    print('Rendered', numgames, 'games in', season, 'in', round(full, 1), 's (',
+          round(results['games_per_second'], 1), 'games/s); rerun with no changes took', round(unchanged, 1), 's')
+    return results
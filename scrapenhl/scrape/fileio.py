@@ -0,0 +1,214 @@
+"""
+Crash-safe writes and consistent reads, so parsing and analysis can run at the same time on one host.
+
+Files are never written in place. Each write goes to a temporary file in the same folder, which is flushed to disk and
+then renamed over the live file in one step. A reader sees either the old file or the new one, never a partial one,
+and a crash mid-write leaves the old file untouched. A reader that has a file open keeps its snapshot even if the file
+is replaced while it reads.
+
+Writers also take an advisory lock (SAVE_FOLDER/.../[file].lock), so two writes of the same file happen one after the
+other rather than at the same time. The lock only orders writes; it does not merge them. Callers that write back a
+whole table held in memory, like write_player_id_file, write_team_id_file, and write_quick_gamelog_file, replace
+whatever another process wrote since they read it. So run one parser per SAVE_FOLDER, or give parallel parsers their
+own tables with SCRAPENHL_SHARD (see scrapenhl_globals.merge_shard_tables). Files written together (e.g. a season's
+aggregate tables) can share one lock through file_lock, which readers can take shared to read the group consistently.
+Locks use fcntl and are skipped where it is not available (Windows); the rename alone still keeps files whole there.
+"""
+
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+### Lock files held by this process, so nested calls for the same lock do not deadlock: lock file: [fd, depth, shared]
+_HELD = {}
+
+
+def get_lock_filename(filename):
+    """
+    Returns the advisory lock file used for a file or group of files
+
+    Parameters
+    -----------
+    filename : str
+        The file path
+
+    Returns
+    --------
+    str
+        [filename].lock
+    """
+    return filename + '.lock'
+
+
+@contextlib.contextmanager
+def file_lock(filename, shared = False):
+    """
+    Holds an advisory lock on filename while in the with block. Locks already held by this process are re-entered.
+
+    An exclusive request inside a shared hold of the same lock raises RuntimeError rather than writing under a reader's
+    lock. Take the exclusive lock first instead; shared requests inside an exclusive hold are fine.
+
+    Parameters
+    -----------
+    filename : str
+        The file path, or any path naming a group of files
+    shared : bool
+        If True, takes a shared (reader) lock, which only waits for exclusive (writer) locks
+    """
+    import os
+    lockfile = get_lock_filename(filename)
+    if lockfile in _HELD:
+        if _HELD[lockfile][2] and not shared:
+            raise RuntimeError('Exclusive lock requested while holding a shared lock on ' + lockfile)
+        _HELD[lockfile][1] += 1
+        try:
+            yield
+        finally:
+            _HELD[lockfile][1] -= 1
+        return
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(lockfile)), exist_ok = True)
+    fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        _HELD[lockfile] = [fd, 1, shared]
+        yield
+    finally:
+        _HELD.pop(lockfile, None)
+        os.close(fd)
+
+
+def get_temp_filename(filename):
+    """
+    Creates an empty temporary file next to filename, for writing before commit_temp_file
+
+    Parameters
+    -----------
+    filename : str
+        The final file path
+
+    Returns
+    --------
+    str
+        The temporary file path, unique to this write
+    """
+    import os
+    import tempfile
+    folder, name = os.path.split(os.path.abspath(filename))
+    os.makedirs(folder, exist_ok = True)
+    fd, tmpname = tempfile.mkstemp(prefix = '.' + name + '.', suffix = '.tmp', dir = folder)
+    os.close(fd)
+    return tmpname
+
+
+def commit_temp_file(tmpname, filename):
+    """
+    Flushes a finished temporary file to disk and renames it over filename
+
+    Parameters
+    -----------
+    tmpname : str
+        The result of get_temp_filename, fully written and closed
+    filename : str
+        The final file path
+    """
+    import os
+    with open(tmpname, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmpname, filename)
+    ### Also flush the folder, so the rename itself survives a crash
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def atomic_write(filename, writer, lock = True):
+    """
+    Writes a file crash-safely: writer fills a temporary file, which then replaces filename
+
+    Parameters
+    -----------
+    filename : str
+        The file path
+    writer : function
+        Called as writer(temporary file path). Should write the complete file there.
+    lock : bool
+        If True, holds the file's advisory lock while writing. Per-game files with a single writer can skip it.
+    """
+    import os
+    with file_lock(filename) if lock else contextlib.suppress():
+        tmpname = get_temp_filename(filename)
+        try:
+            writer(tmpname)
+            commit_temp_file(tmpname, filename)
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+
+def write_feather(df, filename, lock = True):
+    """
+    Writes a dataframe to disk in feather format, crash-safely (see atomic_write)
+
+    Parameters
+    -----------
+    df : pandas df
+        The dataframe
+    filename : str
+        The file path
+    lock : bool
+        If True, holds the file's advisory lock while writing
+    """
+    import feather
+    atomic_write(filename, lambda tmpname: feather.write_dataframe(df, tmpname), lock)
+
+
+def write_bytes(data, filename, lock = True):
+    """
+    Writes bytes to disk, crash-safely (see atomic_write)
+
+    Parameters
+    -----------
+    data : bytes
+        The file contents
+    filename : str
+        The file path
+    lock : bool
+        If True, holds the file's advisory lock while writing
+    """
+    def writer(tmpname):
+        with open(tmpname, 'wb') as w:
+            w.write(data)
+    atomic_write(filename, writer, lock)
+
+
+def read_feather(filename, columns = None):
+    """
+    Reads a feather file as one consistent snapshot, even if a writer replaces it meanwhile
+
+    Parameters
+    -----------
+    filename : str
+        The file path
+    columns : list of str or None
+        Columns to read. None reads all.
+
+    Returns
+    --------
+    pandas df
+        The dataframe
+    """
+    import feather
+    ### Reading through one open handle pins the version that was live when it was opened
+    with open(filename, 'rb') as source:
+        return feather.read_dataframe(source, columns = columns)
@@ -0,0 +1,145 @@
+"""
+In-process cache of per-game files read from disk.
+
+Raw and parsed game files get decompressed and parsed several times within one process (parsing, team logs, analysis).
+This module keeps the results in memory, keyed by (season, game, artifact), bounded by an approximate byte budget with
+least-recently-used eviction. Entries are checked against the file's mtime and size on every access, so a file that is
+rewritten on disk is re-read automatically.
+
+Objects returned from the cache are shared between callers and should not be modified in place.
+"""
+
+import collections
+
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+_CACHE = collections.OrderedDict()
+_CACHE_BYTES = 0
+_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+def get_file_stamp(filename):
+    """
+    Returns a stamp identifying the current version of a file on disk
+
+    Parameters
+    -----------
+    filename : str
+        The file path
+
+    Returns
+    --------
+    tuple
+        (mtime in nanoseconds, size in bytes)
+    """
+    import os
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+def read_cached(season, game, artifact, filename, reader):
+    """
+    Returns the object read from filename, using the in-memory copy if the file has not changed since it was read.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+        The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    artifact : str
+        Which file for this game, e.g. 'json', 'shifts', 'shifts_parsed'
+    filename : str
+        The file path
+    reader : function
+        Called as reader(filename) on a miss. Should return a tuple (object, approximate size in bytes).
+
+    Returns
+    --------
+    object
+        Whatever reader returns as its first element
+    """
+    global _CACHE_BYTES
+    key = (season, game, artifact)
+    stamp = get_file_stamp(filename)
+
+    if key in _CACHE:
+        oldstamp, nbytes, obj = _CACHE[key]
+        if oldstamp == stamp:
+            _CACHE.move_to_end(key)
+            _STATS['hits'] += 1
+            return obj
+        del _CACHE[key]
+        _CACHE_BYTES -= nbytes
+
+    _STATS['misses'] += 1
+    obj, nbytes = reader(filename)
+    if nbytes <= MAX_CACHE_BYTES:
+        _CACHE[key] = (stamp, nbytes, obj)
+        _CACHE_BYTES += nbytes
+        _evict()
+    return obj
+
+def _evict():
+    """
+    Drops least recently used entries until the cache is within MAX_CACHE_BYTES
+    """
+    global _CACHE_BYTES
+    while _CACHE_BYTES > MAX_CACHE_BYTES and len(_CACHE) > 0:
+        _, (_, nbytes, _) = _CACHE.popitem(last = False)
+        _CACHE_BYTES -= nbytes
+        _STATS['evictions'] += 1
+
+def set_max_cache_bytes(nbytes):
+    """
+    Changes the cache size limit, evicting entries if necessary
+
+    Parameters
+    -----------
+    nbytes : int
+        The new approximate limit, in bytes. 0 disables caching.
+    """
+    global MAX_CACHE_BYTES
+    MAX_CACHE_BYTES = nbytes
+    _evict()
+
+def invalidate(season, game, artifact = None):
+    """
+    Removes cached entries for this game
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    artifact : str or None
+        If given, only this artifact is removed. Otherwise all artifacts for the game are removed.
+    """
+    global _CACHE_BYTES
+    keys = [k for k in _CACHE if k[0] == season and k[1] == game and (artifact is None or k[2] == artifact)]
+    for key in keys:
+        _CACHE_BYTES -= _CACHE.pop(key)[1]
+
+def clear_cache():
+    """
+    Empties the cache and resets the hit and miss counters
+    """
+    global _CACHE_BYTES
+    _CACHE.clear()
+    _CACHE_BYTES = 0
+    for key in _STATS:
+        _STATS[key] = 0
+
+def get_cache_stats():
+    """
+    Returns cache counters
+
+    Returns
+    --------
+    dict
+        hits, misses, evictions, entries, and bytes (approximate memory held)
+    """
+    stats = dict(_STATS)
+    stats['entries'] = len(_CACHE)
+    stats['bytes'] = _CACHE_BYTES
+    return stats
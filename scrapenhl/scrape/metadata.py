@@ -0,0 +1,316 @@
+"""
+Player and team metadata from the NHL stats API, fetched in bulk and cached locally.
+
+People and teams are requested many IDs at a time (comma-separated ID lists) and cached in SAVE_FOLDER/metadata/, with a
+time-to-live per table. PLAYER_IDS and TEAM_IDS can then be corrected from the cache in one pass, without reparsing
+games.
+
+For offline use and testing, set SCRAPENHL_FIXTURES (or call set_fixture_folder) to a folder of recorded responses.
+With record = True, responses fetched online are saved there.
+"""
+
+from scrapenhl.scrape import scrapenhl_globals
+from scrapenhl.scrape import fileio
+
+PEOPLE_TTL_DAYS = 7
+TEAMS_TTL_DAYS = 30
+BATCH_SIZE = 100
+
+_FIXTURES = {'folder': None, 'record': False}
+
+
+def set_fixture_folder(folder, record = False):
+    """
+    Makes API requests read from (or, with record = True, save to) recorded responses in a folder
+
+    Parameters
+    -----------
+    folder : str or None
+        The fixture folder. None goes back to the live API.
+    record : bool
+        If True, requests go to the live API and responses are saved in folder.
+    """
+    _FIXTURES['folder'] = folder
+    _FIXTURES['record'] = record
+
+
+def get_fixture_filename(url):
+    """
+    Returns the file a response to this url is recorded in
+
+    Parameters
+    -----------
+    url : str
+        The API url
+
+    Returns
+    --------
+    str
+        [fixture folder]/[md5 of url].json
+    """
+    import hashlib
+    import os
+    folder = _FIXTURES['folder'] or os.environ.get('SCRAPENHL_FIXTURES')
+    return os.path.join(folder, hashlib.md5(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def fetch_json(url):
+    """
+    Returns the json at this url, from recorded fixtures if set up (see set_fixture_folder)
+
+    Parameters
+    -----------
+    url : str
+        The API url
+
+    Returns
+    --------
+    dict
+        The json
+    """
+    import json
+    import os
+    if (_FIXTURES['folder'] or os.environ.get('SCRAPENHL_FIXTURES')) and not _FIXTURES['record']:
+        with open(get_fixture_filename(url), 'r') as r:
+            return json.load(r)
+
+    import urllib.request
+    with urllib.request.urlopen(url) as reader:
+        page = reader.read().decode('latin-1')
+    if _FIXTURES['record']:
+        fileio.write_bytes(page.encode('latin-1'), get_fixture_filename(url))
+    return json.loads(page)
+
+
+def get_people_url(ids):
+    """
+    Returns the NHL API url for several players at once
+
+    Parameters
+    -----------
+    ids : iterable of int
+        Player IDs
+
+    Returns
+    --------
+    str
+        https://statsapi.web.nhl.com/api/v1/people?personIds=[id1],[id2],...
+    """
+    return 'https://statsapi.web.nhl.com/api/v1/people?personIds={0:s}'.format(','.join(str(i) for i in ids))
+
+
+def get_teams_url(ids):
+    """
+    Returns the NHL API url for several teams at once
+
+    Parameters
+    -----------
+    ids : iterable of int
+        Team IDs
+
+    Returns
+    --------
+    str
+        https://statsapi.web.nhl.com/api/v1/teams?teamId=[id1],[id2],...
+    """
+    return 'https://statsapi.web.nhl.com/api/v1/teams?teamId={0:s}'.format(','.join(str(i) for i in ids))
+
+
+def get_metadata_filename(table):
+    """
+    Returns the file name of a metadata cache table
+
+    Parameters
+    -----------
+    table : str
+        'people' or 'teams'
+
+    Returns
+    --------
+    str
+        SAVE_FOLDER/metadata/[table].feather
+    """
+    return '{0:s}metadata/{1:s}.feather'.format(scrapenhl_globals.SAVE_FOLDER, table)
+
+
+def get_metadata(table):
+    """
+    Returns a metadata cache table, or an empty one if none is saved
+
+    Parameters
+    -----------
+    table : str
+        'people' or 'teams'
+
+    Returns
+    --------
+    pandas df
+        people: ID, Name, Pos, Hand, #, Fetched. teams: ID, Name, Abbreviation, Fetched. Fetched is a UTC timestamp.
+    """
+    import os.path
+    import pandas as pd
+    filename = get_metadata_filename(table)
+    if os.path.exists(filename):
+        return fileio.read_feather(filename)
+    if table == 'people':
+        columns = {'ID': 'int64', 'Name': object, 'Pos': object, 'Hand': object, '#': 'int64'}
+    else:
+        columns = {'ID': 'int64', 'Name': object, 'Abbreviation': object}
+    df = pd.DataFrame({col: pd.Series([], dtype = dtype) for col, dtype in columns.items()})
+    return df.assign(Fetched = pd.Series([], dtype = 'datetime64[ns, UTC]'))
+
+
+def _write_metadata(table, df):
+    """
+    Saves a metadata cache table
+
+    Parameters
+    -----------
+    table : str
+        'people' or 'teams'
+    df : pandas df
+        The table
+    """
+    fileio.write_feather(df.sort_values(by = 'ID').reset_index(drop = True), get_metadata_filename(table))
+
+
+def _get_ids_to_fetch(table, ids, ttl_days, force):
+    """
+    Returns the IDs that are missing from a metadata table or older than its time-to-live
+
+    Parameters
+    -----------
+    table : pandas df
+        The result of get_metadata
+    ids : iterable of int
+        IDs wanted
+    ttl_days : float
+        Time-to-live in days
+    force : bool
+        If True, returns all IDs
+
+    Returns
+    --------
+    list of int
+        IDs to fetch
+    """
+    import pandas as pd
+    ids = sorted({int(i) for i in ids})
+    if force:
+        return ids
+    cutoff = pd.Timestamp.now(tz = 'UTC') - pd.Timedelta(days = ttl_days)
+    fresh = set(table.ID[table.Fetched >= cutoff])
+    return [i for i in ids if i not in fresh]
+
+
+def refresh_people(ids, force = False):
+    """
+    Fetches players missing from the people cache, or with expired entries, in batches of BATCH_SIZE per request
+
+    Parameters
+    -----------
+    ids : iterable of int
+        Player IDs
+    force : bool
+        If True, fetches all ids regardless of cache age
+
+    Returns
+    --------
+    pandas df
+        The updated people table (see get_metadata)
+    """
+    import pandas as pd
+    people = get_metadata('people')
+    tofetch = _get_ids_to_fetch(people, ids, PEOPLE_TTL_DAYS, force)
+    if len(tofetch) == 0:
+        return people
+
+    rows = {'ID': [], 'Name': [], 'Pos': [], 'Hand': [], '#': []}
+    for i in range(0, len(tofetch), BATCH_SIZE):
+        for person in fetch_json(get_people_url(tofetch[i:i + BATCH_SIZE])).get('people', []):
+            rows['ID'].append(int(person['id']))
+            rows['Name'].append(person['fullName'])
+            rows['Pos'].append(person.get('primaryPosition', {}).get('code', 'N/A'))
+            rows['Hand'].append(person.get('shootsCatches', 'N/A'))
+            num = person.get('primaryNumber', '')
+            rows['#'].append(int(num) if num not in ('', None) else -1)
+
+    fetched = pd.DataFrame(rows).assign(Fetched = pd.Timestamp.now(tz = 'UTC'))
+    people = pd.concat([people[~people.ID.isin(fetched.ID)], fetched], ignore_index = True)
+    _write_metadata('people', people)
+    return people
+
+
+def refresh_teams(ids, force = False):
+    """
+    Fetches teams missing from the teams cache, or with expired entries, in batches of BATCH_SIZE per request
+
+    Parameters
+    -----------
+    ids : iterable of int
+        Team IDs
+    force : bool
+        If True, fetches all ids regardless of cache age
+
+    Returns
+    --------
+    pandas df
+        The updated teams table (see get_metadata)
+    """
+    import pandas as pd
+    teams = get_metadata('teams')
+    tofetch = _get_ids_to_fetch(teams, ids, TEAMS_TTL_DAYS, force)
+    if len(tofetch) == 0:
+        return teams
+
+    rows = {'ID': [], 'Name': [], 'Abbreviation': []}
+    for i in range(0, len(tofetch), BATCH_SIZE):
+        for team in fetch_json(get_teams_url(tofetch[i:i + BATCH_SIZE])).get('teams', []):
+            rows['ID'].append(int(team['id']))
+            rows['Name'].append(team['name'])
+            rows['Abbreviation'].append(team['abbreviation'])
+
+    fetched = pd.DataFrame(rows).assign(Fetched = pd.Timestamp.now(tz = 'UTC'))
+    teams = pd.concat([teams[~teams.ID.isin(fetched.ID)], fetched], ignore_index = True)
+    _write_metadata('teams', teams)
+    return teams
+
+
+def update_id_tables_from_metadata(refresh = True, force = False):
+    """
+    Corrects names, positions, and handedness in PLAYER_IDS, and names and abbreviations in TEAM_IDS, from the
+    metadata cache, and writes both tables once. Team and jersey number in PLAYER_IDS are left alone, since they are
+    per game.
+
+    Parameters
+    -----------
+    refresh : bool
+        If True, first fetches any players and teams in PLAYER_IDS and TEAM_IDS that are missing or expired in the cache
+    force : bool
+        If True and refresh is True, fetches all players and teams regardless of cache age
+    """
+    playerids = scrapenhl_globals.PLAYER_IDS
+    teamids = scrapenhl_globals.TEAM_IDS
+
+    if refresh:
+        people = refresh_people(playerids.ID.astype(int), force)
+        teams = refresh_teams(teamids.ID.astype(int), force)
+    else:
+        people = get_metadata('people')
+        teams = get_metadata('teams')
+
+    if len(playerids.index) > 0:
+        people = people.assign(ID = people.ID.astype(str))[['ID', 'Name', 'Pos', 'Hand']]
+        merged = playerids.merge(people, how = 'left', on = 'ID', suffixes = ('', '_meta'))
+        for col in ('Name', 'Pos', 'Hand'):
+            merged[col] = merged[col + '_meta'].fillna(merged[col])
+        scrapenhl_globals.PLAYER_IDS = merged[playerids.columns].drop_duplicates()
+        scrapenhl_globals.write_player_id_file()
+
+    if len(teamids.index) > 0:
+        teams = teams.assign(ID = teams.ID.astype(teamids.ID.dtype))[['ID', 'Name', 'Abbreviation']]
+        merged = teamids.merge(teams, how = 'left', on = 'ID', suffixes = ('', '_meta'))
+        for col in ('Name', 'Abbreviation'):
+            merged[col] = merged[col + '_meta'].fillna(merged[col])
+        scrapenhl_globals.TEAM_IDS = merged[teamids.columns].drop_duplicates()
+        scrapenhl_globals.write_team_id_file()
@@ -1,4 +1,16 @@
-import scrapenhl_globals
+from scrapenhl.scrape import scrapenhl_globals
+from scrapenhl.scrape import fileio
+from scrapenhl.scrape import game_cache
+from scrapenhl.scrape import season_aggregates
+from scrapenhl.scrape import metadata
+
+### Bump a stage's version whenever its parsing logic changes, so parse_games knows which games to reparse
+PARSER_VERSIONS = {'pbp': 1, 'shifts': 1}
+### Non-player columns (name, dtype) of each stage's parsed output. Player slot columns vary by game and are excluded.
+PARSED_SCHEMAS = {'pbp': [],
+                  'shifts': [('Time', 'int64'), ('HomeSkaters', 'int8'), ('RoadSkaters', 'int8'),
+                             ('HomeGoaliePulled', 'int8'), ('RoadGoaliePulled', 'int8'), ('Strength', 'int8'),
+                             ('HomeScore', 'int8'), ('RoadScore', 'int8'), ('ScoreDiff', 'int8')]}
 
 def get_url(season, game):
     """
@@ -108,6 +120,124 @@ def get_parsed_shifts_save_filename(season, game):
     """
     return '{0:s}/{1:d}/{2:d}_shifts_parsed.hdf5'.format(scrapenhl_globals.SAVE_FOLDER, season, game)
 
+def _read_zlib_json(filename):
+    """
+    Reads and decompresses a zlib json file, for use with game_cache.read_cached
+
+    Parameters
+    -----------
+    filename : str
+        The file path
+
+    Returns
+    --------
+    tuple
+        (json dict, approximate size in memory in bytes)
+    """
+    import zlib
+    import json
+    with open(filename, 'rb') as r:
+        page = zlib.decompress(r.read())
+    ### Decoded dicts and strings take several times the size of the text
+    return json.loads(page.decode('latin-1')), 4 * len(page)
+
+def _read_hdf(filename):
+    """
+    Reads a dataframe saved in hdf5 format, for use with game_cache.read_cached
+
+    Parameters
+    -----------
+    filename : str
+        The file path
+
+    Returns
+    --------
+    tuple
+        (dataframe, size in memory in bytes)
+    """
+    import pandas as pd
+    df = pd.read_hdf(filename)
+    return df, int(df.memory_usage(deep = True).sum())
+
+def get_game_json(season, game):
+    """
+    Returns the game's raw json from disk, using the in-process cache in game_cache.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+        The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    Returns
+    --------
+    dict
+        The json from the NHL API. Do not modify in place.
+    """
+    return game_cache.read_cached(season, game, 'json', get_json_save_filename(season, game), _read_zlib_json)
+
+def get_shift_json(season, game):
+    """
+    Returns the game's raw shift json from disk, using the in-process cache in game_cache.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+        The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    Returns
+    --------
+    dict
+        The shift json from the NHL API. Do not modify in place.
+    """
+    return game_cache.read_cached(season, game, 'shifts', get_shift_save_filename(season, game), _read_zlib_json)
+
+def get_parsed_shifts(season, game, use_cache = True):
+    """
+    Returns the game's parsed toi dataframe from disk, using the in-process cache in game_cache.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+        The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    use_cache : bool
+        If False, reads from disk without keeping the result in memory, e.g. when going through a whole season once.
+    Returns
+    --------
+    pandas df
+        The toi dataframe written by parse_game. Do not modify in place.
+    """
+    if not use_cache:
+        return _read_hdf(get_parsed_shifts_save_filename(season, game))[0]
+    return game_cache.read_cached(season, game, 'shifts_parsed', get_parsed_shifts_save_filename(season, game),
+                                  _read_hdf)
+
+def get_parsed_shifts_columns(season, game):
+    """
+    Returns the columns of the game's parsed toi dataframe, without reading its rows
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+
+    Returns
+    --------
+    list of str
+        The column names
+    """
+    import pandas as pd
+    with pd.HDFStore(get_parsed_shifts_save_filename(season, game), mode = 'r') as store:
+        return list(store.select(store.keys()[0], start = 0, stop = 0).columns)
+
 def scrape_game(season, game, force_overwrite = False):
     """
     Scrapes and saves game files in compressed (zlib) format
@@ -145,9 +275,7 @@ def scrape_game(season, game, force_overwrite = False):
         if game < 30111:
             import zlib
             page2 = zlib.compress(page, level=9)
-            w = open(filename, 'wb')
-            w.write(page2)
-            w.close()
+            fileio.write_bytes(page2, filename, lock = False)
 
     url = get_shift_url(season, game)
     filename = get_shift_save_filename(season, game)
@@ -164,18 +292,19 @@ def scrape_game(season, game, force_overwrite = False):
         if game < 30111:
             import zlib
             page2 = zlib.compress(page, level=9)
-            w = open(filename, 'wb')
-            w.write(page2)
-            w.close()
+            fileio.write_bytes(page2, filename, lock = False)
 
     return query
 
-def parse_game(season, game, force_overwrite = False):
+def parse_game(season, game, force_overwrite = False, stages = None):
     """
     Reads this game's zlib file from disk and parses into a friendlier format, then saves again to disk in zlib.
 
     This method also updates the global player id and game log files, and writes any updates to disk.
 
+    Parsed files are stamped with the parser version and schema hash of their stage (see PARSER_VERSIONS), and a stage
+    is only parsed again if its file is missing or its stamp is out of date.
+
     Parameters
     -----------
     season : int
@@ -184,42 +313,34 @@ def parse_game(season, game, force_overwrite = False):
         The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
         The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
     force_overwrite : bool
-        If True, will overwrite previously raw html files. If False, will not scrape if files already found.
+        If True, will overwrite previously parsed files. If False, will only parse stages that are stale.
+    stages : iterable of str or None
+        Stages to parse, from PARSER_VERSIONS ('pbp', 'shifts'). None means all stages.
     """
-    import os.path
-    import zlib
-    import json
-    import pandas as pd
-    filename = get_parsed_save_filename(season, game)
-    if (force_overwrite or not os.path.exists(filename)):
-        r = open(get_json_save_filename(season, game), 'rb')
-        page = r.read()
-        r.close()
+    if stages is None:
+        stages = PARSER_VERSIONS.keys()
+    stages = set(stages)
 
-        page = zlib.decompress(page)
-        data = json.loads(page.decode('latin-1'))
+    if 'pbp' in stages and (force_overwrite or get_parsed_stage_status(season, game, 'pbp') != 'current'):
+        data = get_game_json(season, game)
 
         teamdata = data['liveData']['boxscore']['teams']
 
         update_team_ids_from_json(teamdata)
-        update_player_ids_from_json(teamdata)
+        update_player_ids_from_roster(get_game_roster(season, game, teamdata, force_overwrite))
         update_quick_gamelog_from_json(data)
 
         events = read_events_from_json(data['liveData']['plays']['allPlays'])
+        ### Nothing else marks the stage as done until parsed pbp is written, so stamp it here
+        write_stage_stamp(season, game, 'pbp')
 
         #pbp_compressed = zlib.compress(bytes(events, encoding = 'latin-1'), level=9)
         #w = open(filename, 'wb')
         #w.write(pbp_compressed)
         #w.close()
 
-    filename = get_parsed_shifts_save_filename(season, game)
-    if (force_overwrite or not os.path.exists(filename)):
-        r = open(get_shift_save_filename(season, game), 'rb')
-        page = r.read()
-        r.close()
-
-        page = zlib.decompress(page)
-        data = json.loads(page.decode('latin-1'))
+    if 'shifts' in stages and (force_overwrite or get_parsed_stage_status(season, game, 'shifts') != 'current'):
+        data = get_shift_json(season, game)
 
         try:
             thisgamedata = scrapenhl_globals.BASIC_GAMELOG.query('Season == {0:d} & Game == {1:d}'.format(season, game))
@@ -229,34 +350,279 @@ def parse_game(season, game, force_overwrite = False):
             hname = None
             rname = None
 
+        ### Game json is needed for goalies and goals; it is usually already in the cache from above
+        try:
+            gamedata = get_game_json(season, game)
+            if hname is None:
+                hname = gamedata['gameData']['teams']['home']['abbreviation']
+                rname = gamedata['gameData']['teams']['away']['abbreviation']
+        except Exception as e:
+            gamedata = None
+
         shifts = read_shifts_from_json(data['data'], hname, rname)
 
+        if shifts is not None and gamedata is None:
+            ### Without goalies and goals the file would lack the game state columns, and its schema hash would never
+            ### match PARSED_SCHEMAS. So leave the stage missing until the game json is there.
+            print('Skipping shifts for', season, game, '; game json is missing')
+            shifts = None
+
         if shifts is not None:
+            goalies = get_goalie_ids_from_json(gamedata['liveData']['boxscore']['teams'])
+            goals = read_goals_from_json(gamedata['liveData']['plays']['allPlays'])
+            shifts = add_game_state_to_toi(shifts, hname, rname, goalies, goals)
+
             #shifts = ''
             #shifts_compressed = zlib.compress(shifts, level=9)
             #w = open(filename, 'wb')
             #w.write(shifts_compressed)
             #w.close()
-            shifts.to_hdf(filename, key = 'Game{0:d}0{1:d}'.format(season, game), mode = 'w',
-                          complevel = 9, complib = 'zlib')
+            filename = get_parsed_shifts_save_filename(season, game)
+            ### Old totals need to come out of the season aggregates if this game was already included
+            oldshifts = None
+            if season_aggregates.is_game_included(season, game):
+                try:
+                    oldshifts = get_parsed_shifts(season, game, use_cache = False)
+                except Exception as e:
+                    oldshifts = None
+
+            write_parsed_hdf(shifts, filename, season, game, 'shifts')
+            season_aggregates.update_season_aggregates(season, game, shifts, hname, rname, oldshifts)
+
+def get_schema_hash(columns):
+    """
+    Returns a short hash of a list of (column name, dtype) pairs
+
+    Parameters
+    -----------
+    columns : list of tuple
+        (column name, dtype string) pairs, e.g. an entry in PARSED_SCHEMAS
+
+    Returns
+    --------
+    str
+        Hex hash
+    """
+    import hashlib
+    return hashlib.md5(repr([(str(c), str(t)) for c, t in columns]).encode('utf-8')).hexdigest()[:12]
+
+def get_frame_schema(df):
+    """
+    Returns the non-player columns of a parsed dataframe as (name, dtype) pairs. Player slot columns end in a digit.
+
+    Parameters
+    -----------
+    df : pandas df
+        A parsed dataframe
+
+    Returns
+    --------
+    list of tuple
+        (column name, dtype string) pairs
+    """
+    return [(c, str(t)) for c, t in df.dtypes.items() if not str(c)[-1].isdigit()]
+
+def write_parsed_hdf(df, filename, season, game, stage):
+    """
+    Writes a parsed dataframe to disk in hdf5 format, stamped with the stage's parser version and the frame's schema hash
+
+    Parameters
+    -----------
+    df : pandas df
+        The parsed dataframe
+    filename : str
+        The file path
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    stage : str
+        Key in PARSER_VERSIONS
+    """
+    import pandas as pd
+    key = 'Game{0:d}0{1:d}'.format(season, game)
+
+    def writer(tmpname):
+        with pd.HDFStore(tmpname, mode = 'w', complevel = 9, complib = 'zlib') as store:
+            store.put(key, df)
+            attrs = store.get_storer(key).attrs
+            attrs.parser_version = PARSER_VERSIONS[stage]
+            attrs.schema_hash = get_schema_hash(get_frame_schema(df))
+    fileio.atomic_write(filename, writer, lock = False)
+
+def get_stage_stamp_filename(season, game, stage):
+    """
+    Returns the save file name of the stamp marking a stage done, for stages without a stamped hdf5 file
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    stage : str
+        Key in PARSER_VERSIONS
+
+    Returns
+    --------
+    str
+        file name, SAVE_FOLDER/Season/Game_[stage].stamp
+    """
+    return '{0:s}{1:d}/{2:d}_{3:s}.stamp'.format(scrapenhl_globals.SAVE_FOLDER, season, game, stage)
+
+def write_stage_stamp(season, game, stage):
+    """
+    Marks a stage done for this game with the stage's current parser version and schema hash
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    stage : str
+        Key in PARSER_VERSIONS
+    """
+    stamp = '{0:d} {1:s}'.format(PARSER_VERSIONS[stage], get_schema_hash(PARSED_SCHEMAS[stage]))
+    fileio.write_bytes(stamp.encode('latin-1'), get_stage_stamp_filename(season, game, stage), lock = False)
+
+def get_parsed_stamp(filename):
+    """
+    Returns the parser version and schema hash stamped on a parsed hdf5 file, or stored in a stage stamp file
+
+    Parameters
+    -----------
+    filename : str
+        The file path, an hdf5 file or a .stamp file (see get_stage_stamp_filename)
+
+    Returns
+    --------
+    tuple
+        (parser version, schema hash). (0, '') if the file was written before files were stamped.
+    """
+    import pandas as pd
+    if filename.endswith('.stamp'):
+        with open(filename, 'r') as r:
+            version, schema = r.read().split()
+        return int(version), schema
+    with pd.HDFStore(filename, mode = 'r') as store:
+        attrs = store.get_storer(store.keys()[0]).attrs
+        return getattr(attrs, 'parser_version', 0), getattr(attrs, 'schema_hash', '')
+
+def get_parsed_stage_status(season, game, stage):
+    """
+    Checks whether this game's parsed file for the given stage is up to date with the current parser
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    stage : str
+        Key in PARSER_VERSIONS
+
+    Returns
+    --------
+    str
+        'current', 'missing', 'old version', or 'schema changed'
+    """
+    import os.path
+    if stage == 'pbp':
+        ### read_events_from_json does not produce output yet, so the stage is tracked with a stamp file
+        filename = get_stage_stamp_filename(season, game, stage)
+    else:
+        filename = get_parsed_shifts_save_filename(season, game)
+    if not os.path.exists(filename):
+        return 'missing'
+    try:
+        version, schema = get_parsed_stamp(filename)
+    except Exception as e:
+        return 'missing'
+    if version != PARSER_VERSIONS[stage]:
+        return 'old version'
+    if schema != get_schema_hash(PARSED_SCHEMAS[stage]):
+        return 'schema changed'
+    return 'current'
 
 def read_shifts_from_json(data, homename = None, roadname = None):
+    """
+    Turns the shift json into a dataframe with one row per second and one column per on-ice slot.
+
+    The cleaned-up shifts from read_shift_intervals_from_json are expanded to seconds. Slot columns are named
+    [Team][Slot], e.g. WSH1, WSH2, and no slots are dropped.
+
+    Parameters
+    -----------
+    data : list
+        A json list that is the result of shift_page['data']
+    homename : str
+        Home team abbreviation. If None, inferred from the data (home players seem to come first).
+    roadname : str
+        Road team abbreviation. If None, inferred from the data.
+
+    Returns
+    --------
+    pandas df
+        Dataframe with a Time column (seconds elapsed) and player ID columns, or None if there are no shifts
+    """
+    df = read_shift_intervals_from_json(data, homename, roadname)
+    if df is None:
+        return
+
+    import numpy as np
+    import pandas as pd
+    ### Fill the time x slot grid directly from the intervals
+    maxtime = df.End.max()
+    toi = pd.DataFrame({'Time': np.arange(0, maxtime + 1)})
+    for team in df.Team.unique():
+        teamdf = df[df.Team == team]
+        slots = teamdf.Slot.to_numpy()
+        lengths = (teamdf.End - teamdf.Start + 1).to_numpy()
+        times = np.repeat(teamdf.Start.to_numpy(), lengths) + \
+                np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        grid = np.full((maxtime + 1, slots.max()), np.nan)
+        grid[times, np.repeat(slots - 1, lengths)] = np.repeat(teamdf.PlayerID.to_numpy(dtype = float), lengths)
+        toi = toi.assign(**{'{0:s}{1:d}'.format(team, i + 1): grid[:, i] for i in range(grid.shape[1])})
+
+    return toi
+
+def read_shift_intervals_from_json(data, homename = None, roadname = None):
+    """
+    Turns the shift json into a cleaned-up dataframe of shifts.
+
+    Shifts that cross a period boundary (goalies) are extended into the next period, overlapping or duplicate shifts for
+    the same player are merged, and each shift is given a slot number that it keeps for its whole length.
 
+    Parameters
+    -----------
+    data : list
+        A json list that is the result of shift_page['data']
+    homename : str
+        Home team abbreviation. If None, inferred from the data (home players seem to come first).
+    roadname : str
+        Road team abbreviation. If None, inferred from the data.
+
+    Returns
+    --------
+    pandas df
+        Dataframe with columns Team, PlayerID, Start, End (seconds elapsed, inclusive), and Slot, home team first and
+        sorted by start time within team, or None if there are no shifts
+    """
     if len(data) == 0:
         return
-    ids = ['' for i in range(len(data))]
+    ids = [0 for i in range(len(data))]
     periods = [0 for i in range(len(data))]
     starts = ['0:00' for i in range(len(data))]
     ends = ['0:00' for i in range(len(data))]
     teams = ['' for i in range(len(data))]
-    durations = [0 for i in range(len(data))]
 
     for i, dct in enumerate(data):
         ids[i] = dct['playerId']
         periods[i] = dct['period']
         starts[i] = dct['startTime']
         ends[i] = dct['endTime']
-        durations[i] = dct['duration']
         teams[i] = dct['teamAbbrev']
 
     ### Seems like home players come first
@@ -267,194 +633,336 @@ def read_shifts_from_json(data, homename = None, roadname = None):
                 roadname = teams[i]
                 break
 
-    startmin = [x[:x.index(':')] for x in starts]
-    startsec = [x[x.index(':') + 1:] for x in starts]
-    starttimes = [1200 * (p-1) + 60 * int(m) + int(s) for p, m, s in zip(periods, startmin, startsec)]
-    endmin = [x[:x.index(':')] for x in ends]
-    endsec = [x[x.index(':') + 1:] for x in ends]
-    ### There is an extra -1 in endtimes to avoid overlapping start/end
-    endtimes = [1200 * (p - 1) + 60 * int(m) + int(s) - 1 for p, m, s in zip(periods, endmin, endsec)]
+    import numpy as np
+    import pandas as pd
+    df = pd.DataFrame({'PlayerID': ids, 'Period': periods, 'Start': starts, 'End': ends, 'Team': teams})
+    df = df.dropna(subset = ['Start', 'End'])
+
+    def to_seconds(times):
+        minsec = times.str.split(':', expand = True).astype(int)
+        return 60 * minsec[0] + minsec[1]
+
+    periodstart = 1200 * (df.Period.to_numpy() - 1)
+    start = to_seconds(df.Start).to_numpy() + periodstart
+    end = to_seconds(df.End).to_numpy() + periodstart
+    ### Shifts that end earlier in the period than they start carried over into the next period (usually goalies)
+    end = np.where(end < start, end + 1200, end)
+    ### There is an extra -1 in end times to avoid overlapping start/end
+    df = df.assign(Start = start, End = end - 1)
+    ### Drops zero-length entries, e.g. goal markers
+    df = df[(df.End >= df.Start) & df.Team.isin([homename, roadname])]
+    if len(df.index) == 0:
+        return
+
+    ### Merge overlapping and duplicate shifts for each player, so each player appears at most once per second
+    df = df.sort_values(by = ['Team', 'PlayerID', 'Start'], kind = 'stable')
+    prevend = df.groupby('PlayerID').End.cummax().groupby(df.PlayerID).shift()
+    newshift = prevend.isnull() | (df.Start > prevend + 1)
+    df = df.assign(ShiftNum = newshift.cumsum())
+    df = df.groupby(['Team', 'PlayerID', 'ShiftNum'], as_index = False).agg(Start = ('Start', 'min'),
+                                                                             End = ('End', 'max'))
+
+    ### Assign slots per team
+    intervals = []
+    for team in (homename, roadname):
+        teamdf = df[df.Team == team].sort_values(by = ['Start', 'PlayerID'], kind = 'stable')
+        if len(teamdf.index) == 0:
+            continue
+        teamdf = teamdf.assign(Slot = _assign_shift_slots(teamdf.Start.to_numpy(), teamdf.End.to_numpy()))
+        intervals.append(teamdf[['Team', 'PlayerID', 'Start', 'End', 'Slot']])
+
+    return pd.concat(intervals, ignore_index = True)
+
+def _assign_shift_slots(starts, ends):
+    """
+    Gives each shift the lowest slot number not in use by another shift at the time it starts.
+
+    Parameters
+    -----------
+    starts : numpy array
+        Shift start times, sorted ascending
+    ends : numpy array
+        Shift end times (inclusive), same order as starts
+
+    Returns
+    --------
+    numpy array
+        Slot numbers, starting at 1
+    """
+    import heapq
+    import numpy as np
+    slots = np.zeros(len(starts), dtype = int)
+    busy = []
+    free = []
+    numslots = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        while len(busy) > 0 and busy[0][0] < start:
+            heapq.heappush(free, heapq.heappop(busy)[1])
+        if len(free) > 0:
+            slot = heapq.heappop(free)
+        else:
+            numslots += 1
+            slot = numslots
+        heapq.heappush(busy, (end, slot))
+        slots[i] = slot
+    return slots
+
+def get_goalie_ids_from_json(teamdata):
+    """
+    Returns the IDs of all goalies dressed for this game
+
+    Parameters
+    -----------
+    teamdata : dict
+        A json dict that is the result of api_page['liveData']['boxscore']['teams']
 
-    durationtime = [e - s for s, e in zip(starttimes, endtimes)]
+    Returns
+    --------
+    set of int
+        Goalie player IDs for both teams
+    """
+    goalies = set()
+    for side in ('home', 'away'):
+        for pdata in teamdata[side]['players'].values():
+            if pdata['position']['code'] == 'G':
+                goalies.add(int(pdata['person']['id']))
+    return goalies
+
+def read_goals_from_json(pbp):
+    """
+    Returns the time of each goal in the game and the score after it. Shootout goals are excluded.
+
+    Parameters
+    -----------
+    pbp : list
+        A json list that is the result of api_page['liveData']['plays']['allPlays']
+
+    Returns
+    --------
+    pandas df
+        Dataframe with columns Time (seconds elapsed, same scale as the toi dataframe), HomeScore, and RoadScore
+    """
+    times = []
+    hscores = []
+    rscores = []
+    for play in pbp:
+        if play['result']['eventTypeId'] != 'GOAL' or play['about']['periodType'] == 'SHOOTOUT':
+            continue
+        m, s = play['about']['periodTime'].split(':')
+        times.append(1200 * (play['about']['period'] - 1) + 60 * int(m) + int(s))
+        hscores.append(play['about']['goals']['home'])
+        rscores.append(play['about']['goals']['away'])
 
     import pandas as pd
-    df = pd.DataFrame({'PlayerID': ids, 'Period': periods, 'Start': starttimes, 'End': endtimes,
-                       'Team': teams, 'Duration': durationtime})
-    ### TODO: fill in code here for goalies who can have a shift start and shift end in different periods
-    ### All I need to do is see whether I subtract 1200 from start or add 1200 to end
-    tempdf = df[['PlayerID', 'Start', 'End', 'Team', 'Duration']]
-    tempdf = tempdf.assign(Time = tempdf.Start)
-    #print(tempdf.head(20))
-
-    toi = pd.DataFrame({'Time': [i for i in range(0, max(df.End) + 1)]})
-
-    toidfs = []
-    while len(tempdf.index) > 0:
-        temptoi = toi.merge(tempdf, how = 'inner', on = 'Time')
-        toidfs.append(temptoi)
-
-        tempdf = tempdf.assign(Time = tempdf.Time + 1)
-        tempdf = tempdf.query('Time <= End')
-
-    tempdf = pd.concat(toidfs)
-    tempdf = tempdf.sort_values(by = 'Time')
-
-    ### Append team name to start of columns by team
-    hdf = tempdf.query('Team == "' + homename + '"')
-    hdf2 = hdf.groupby('Time').rank()
-    hdf2 = hdf2.rename(columns = {'PlayerID': 'rank'})
-    hdf2['rank'] = hdf2['rank'].apply(lambda x: int(x))
-    hdf['rank'] = homename + hdf2['rank'].astype('str')
-
-    rdf = tempdf.query('Team == "' + roadname + '"')
-    rdf2 = rdf.groupby('Time').rank()
-    rdf2 = rdf2.rename(columns={'PlayerID': 'rank'})
-    rdf2['rank'] = rdf2['rank'].apply(lambda x: int(x))
-    rdf['rank'] = roadname + rdf2['rank'].astype('str')
-
-    ### Occasionally bad entries make duplicates on time and rank. Take one with longer duration
-
-    tokeep = hdf.sort_values(by = 'Duration', ascending = False)
-    tokeep = tokeep.groupby(['Time', 'PlayerID']).first()
-    tokeep.reset_index(inplace = True)
-    hdf = hdf.merge(tokeep, how = 'inner', on = ['Time', 'PlayerID', 'Start', 'End', 'Team', 'rank'])
-
-    tokeep = rdf.sort_values(by='Duration', ascending=False)
-    tokeep = tokeep.groupby(['Time', 'PlayerID']).first()
-    tokeep.reset_index(inplace=True)
-    rdf = rdf.merge(tokeep, how='inner', on=['Time', 'PlayerID', 'Start', 'End', 'Team', 'rank'])
-
-    ### Remove values above 6--looking like there won't be many
-    hdf = hdf.pivot(index = 'Time', columns = 'rank', values = 'PlayerID').iloc[:, 1:6]
-    hdf.reset_index(inplace = True) #get time back as a column
-    rdf = rdf.pivot(index='Time', columns='rank', values='PlayerID').iloc[:, 1:6]
-    rdf.reset_index(inplace = True)
-
-    toi = toi.merge(hdf, how = 'left', on = 'Time').merge(rdf, how = 'left', on = 'Time')
-
-    return(toi)
+    goals = pd.DataFrame({'Time': times, 'HomeScore': hscores, 'RoadScore': rscores})
+    return goals.sort_values(by = 'Time', kind = 'stable')
+
+def add_game_state_to_toi(toi, homename, roadname, goalies, goals):
+    """
+    Adds strength and score state columns to the toi dataframe.
+
+    All columns are int8 and computed for the whole game at once:
+
+    - HomeSkaters, RoadSkaters: number of non-goalies on ice
+    - HomeGoaliePulled, RoadGoaliePulled: 1 if the team has skaters but no goalie on ice
+    - Strength: 10 * HomeSkaters + RoadSkaters, so 55 is 5v5, 54 is a home 5v4 power play, 45 is a road power play
+    - HomeScore, RoadScore: score before any goal scored at this second
+    - ScoreDiff: HomeScore - RoadScore
+
+    So filtering to 5v5 with goalies in is (toi.Strength == 55) & (toi.HomeGoaliePulled == 0) &
+    (toi.RoadGoaliePulled == 0).
+
+    Parameters
+    -----------
+    toi : pandas df
+        The result of read_shifts_from_json
+    homename : str
+        Home team abbreviation, used as the prefix of home player columns
+    roadname : str
+        Road team abbreviation, used as the prefix of road player columns
+    goalies : iterable of int
+        IDs of goalies in this game
+    goals : pandas df
+        The result of read_goals_from_json
+
+    Returns
+    --------
+    pandas df
+        toi with the new columns added
+    """
+    import numpy as np
+
+    goalies = np.array(sorted(goalies), dtype = float)
+
+    def count_team(prefix):
+        cols = [c for c in toi.columns if c != 'Time' and c.startswith(prefix)]
+        players = toi[cols].to_numpy(dtype = float)
+        onice = ~np.isnan(players)
+        isgoalie = np.isin(players, goalies)
+        skaters = np.minimum((onice & ~isgoalie).sum(axis = 1), 9)
+        pulled = (skaters > 0) & ~isgoalie.any(axis = 1)
+        return skaters.astype(np.int8), pulled.astype(np.int8)
+
+    hskaters, hpulled = count_team(homename)
+    rskaters, rpulled = count_team(roadname)
+
+    ### Number of goals strictly before each second indexes into the running score
+    goalnum = np.searchsorted(goals.Time.to_numpy(), toi.Time.to_numpy(), side = 'left')
+    hscore = np.concatenate([[0], goals.HomeScore.to_numpy()])[goalnum].astype(np.int8)
+    rscore = np.concatenate([[0], goals.RoadScore.to_numpy()])[goalnum].astype(np.int8)
+
+    return toi.assign(HomeSkaters = hskaters, RoadSkaters = rskaters,
+                      HomeGoaliePulled = hpulled, RoadGoaliePulled = rpulled,
+                      Strength = (10 * hskaters + rskaters).astype(np.int8),
+                      HomeScore = hscore, RoadScore = rscore,
+                      ScoreDiff = (hscore - rscore).astype(np.int8))
 
 def update_team_ids_from_json(teamdata):
+    """
+    Adds the teams in this game to global TEAM_IDS if they aren't there yet, and writes TEAM_IDS to disk if so.
 
-    hid = teamdata['home']['team']['id']
-    if hid not in scrapenhl_globals.TEAM_IDS:
-        import urllib.request
-        import json
-        import pandas as pd
-        url = 'https://statsapi.web.nhl.com{0:s}'.format(teamdata['home']['team']['link'])
-        with urllib.request.urlopen(url) as reader:
-            page = reader.read()
-        teaminfo = json.loads(page.decode('latin-1'))
-        hid = teaminfo['teams'][0]['id']
-        habbrev = teaminfo['teams'][0]['abbreviation']
-        hname = teaminfo['teams'][0]['name']
-
-        df = pd.DataFrame({'ID': [hid], 'Abbreviation': [habbrev], 'Name': [hname]})
-        scrapenhl_globals.TEAM_IDS = pd.concat([scrapenhl_globals.TEAM_IDS, df])
-        scrapenhl_globals.write_team_id_file()
-
-    rid = teamdata['away']['team']['id']
-    if rid not in scrapenhl_globals.TEAM_IDS:
-        import urllib.request
-        import json
-        url = 'https://statsapi.web.nhl.com{0:s}'.format(teamdata['away']['team']['link'])
-        with urllib.request.urlopen(url) as reader:
-            page = reader.read()
-        teaminfo = json.loads(page.decode('latin-1'))
-        rid = teaminfo['teams'][0]['id']
-        rabbrev = teaminfo['teams'][0]['abbreviation']
-        rname = teaminfo['teams'][0]['name']
-
-        df = pd.DataFrame({'ID': [rid], 'Abbreviation': [rabbrev], 'Name': [rname]})
-        scrapenhl_globals.TEAM_IDS = pd.concat([scrapenhl_globals.TEAM_IDS, df])
-        scrapenhl_globals.write_team_id_file()
+    Team info comes from the metadata cache (see metadata.refresh_teams), so the API is only queried for teams that
+    have never been seen.
 
-def update_player_ids_from_json(teamdata):
+    Parameters
+    -----------
+    teamdata : dict
+        A json dict that is the result of api_page['liveData']['boxscore']['teams']
     """
-    Creates a data frame of player data from current game's json[liveData][boxscore] to update global PLAYER_IDS.
+    known = {int(x) for x in scrapenhl_globals.TEAM_IDS.ID}
+    missing = {teamdata[side]['team']['id'] for side in ('home', 'away')} - known
+    if len(missing) == 0:
+        return
 
-    This method reads player ids, names, handedness, team, position, and number, and full joins to PLAYER_IDS.
-    If there are any changes to PLAYER_IDS, the dataframe gets written to disk again.
+    import pandas as pd
+    teams = metadata.refresh_teams(missing)
+    df = teams[teams.ID.isin(missing)][['ID', 'Abbreviation', 'Name']]
+    scrapenhl_globals.TEAM_IDS = pd.concat([scrapenhl_globals.TEAM_IDS, df], ignore_index = True)
+    scrapenhl_globals.write_team_id_file()
+
+def get_roster_save_filename(season, game):
+    """
+    Returns the algorithm-determined save file name of the game's roster sidecar.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+        The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    Returns
+    --------
+    str
+        file name, SAVE_FOLDER/Season/Game_roster.feather
+    """
+    return '{0:s}{1:d}/{2:d}_roster.feather'.format(scrapenhl_globals.SAVE_FOLDER, season, game)
+
+def get_game_roster(season, game, teamdata = None, force_overwrite = False):
+    """
+    Returns the game's roster, reading the roster sidecar if it exists, and otherwise reading the boxscore and saving
+    the sidecar for next time. Rosters don't change once a game is final, so the sidecar never needs updating.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+        The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    teamdata : dict or None
+        A json dict that is the result of api_page['liveData']['boxscore']['teams']. Read from disk if needed and None.
+    force_overwrite : bool
+        If True, rereads the boxscore and rewrites the sidecar.
+
+    Returns
+    --------
+    pandas df
+        Dataframe with columns ID, Name, Team, Pos, #, and Hand
+    """
+    import os.path
+    filename = get_roster_save_filename(season, game)
+    if not force_overwrite and os.path.exists(filename):
+        return fileio.read_feather(filename)
+
+    if teamdata is None:
+        teamdata = get_game_json(season, game)['liveData']['boxscore']['teams']
+    roster = read_roster_from_json(teamdata)
+    fileio.write_feather(roster, filename, lock = False)
+    return roster
+
+def read_roster_from_json(teamdata):
+    """
+    Creates a data frame of player data from current game's json[liveData][boxscore].
+
+    This method reads player ids, names, handedness, team, position, and number.
 
     Parameters
     -----------
     teamdata : dict
         A json dict that is the result of api_page['liveData']['boxscore']['teams']
+
+    Returns
+    --------
+    pandas df
+        Dataframe with columns ID, Name, Team, Pos, #, and Hand
     """
-    rteam = scrapenhl_globals.TEAM_IDS.query('ID == ' + str(teamdata['away']['team']['id']))
-    rabbrev = rteam['Abbreviation'].iloc[0]
-    hteam = scrapenhl_globals.TEAM_IDS.query('ID == ' + str(teamdata['home']['team']['id']))
-    habbrev = hteam['Abbreviation'].iloc[0]
-
-    awayplayers = teamdata['away']['players']
-    homeplayers = teamdata['home']['players']
-
-    numplayers = len(awayplayers) + len(homeplayers)
-    ids = ['' for i in range(numplayers)]
-    names = ['' for i in range(numplayers)]
-    teams = ['' for i in range(numplayers)]
-    positions = ['' for i in range(numplayers)]
-    nums = [-1 for i in range(numplayers)]
-    handedness = ['' for i in range(numplayers)]
-
-    for i, (pid, pdata) in enumerate(awayplayers.items()):
-        idnum = pid[2:]
-        name = pdata['person']['fullName']
-        try:
-            hand = pdata['person']['shootsCatches']
-        except KeyError:
-            hand = 'N/A'
-        try:
-            num = pdata['jerseyNumber']
-            if num == '':
-                raise KeyError
-        except KeyError:
-            num = -1
-        pos = pdata['position']['code']
-
-        ids[i] = idnum
-        names[i] = name
-        teams[i] = rabbrev
-        positions[i] = pos
-        nums[i] = num
-        handedness[i] = hand
-
-    for i, (pid, pdata) in enumerate(homeplayers.items()):
-        idnum = pid[2:]
-        name = pdata['person']['fullName']
-        try:
-            hand = pdata['person']['shootsCatches']
-        except KeyError:
-            hand = 'N/A'
-        try:
-            num = pdata['jerseyNumber']
-            if num == '':
-                raise KeyError
-        except KeyError:
-            num = -1
-        pos = pdata['position']['code']
-
-        ids[i + len(awayplayers)] = idnum
-        names[i + len(awayplayers)] = name
-        teams[i + len(awayplayers)] = habbrev
-        positions[i + len(awayplayers)] = pos
-        nums[i + len(awayplayers)] = num
-        handedness[i + len(awayplayers)] = hand
+    ids = []
+    names = []
+    teams = []
+    positions = []
+    nums = []
+    handedness = []
+
+    for side in ('away', 'home'):
+        team = scrapenhl_globals.TEAM_IDS.query('ID == ' + str(teamdata[side]['team']['id']))
+        abbrev = team['Abbreviation'].iloc[0]
+
+        for pid, pdata in teamdata[side]['players'].items():
+            try:
+                hand = pdata['person']['shootsCatches']
+            except KeyError:
+                hand = 'N/A'
+            try:
+                num = pdata['jerseyNumber']
+                if num == '':
+                    raise KeyError
+            except KeyError:
+                num = -1
+
+            ids.append(pid[2:])
+            names.append(pdata['person']['fullName'])
+            teams.append(abbrev)
+            positions.append(pdata['position']['code'])
+            nums.append(int(num))
+            handedness.append(hand)
 
     import pandas as pd
-    gamedf = pd.DataFrame({'ID': ids,
-                           'Name': names,
-                           'Team': teams,
-                           'Pos': positions,
-                           '#': nums,
-                           'Hand': handedness})
+    return pd.DataFrame({'ID': ids,
+                         'Name': names,
+                         'Team': teams,
+                         'Pos': positions,
+                         '#': nums,
+                         'Hand': handedness})
+
+def update_player_ids_from_roster(gamedf):
+    """
+    Adds rows from a game roster to global PLAYER_IDS.
+
+    If there are any changes to PLAYER_IDS, the dataframe gets written to disk again.
+
+    Parameters
+    -----------
+    gamedf : pandas df
+        The result of get_game_roster or read_roster_from_json
+    """
+    import pandas as pd
     ### Find change in length and join
     oldlength = len(scrapenhl_globals.PLAYER_IDS)
     if(oldlength == 0):
         scrapenhl_globals.PLAYER_IDS = gamedf
     else:
-        scrapenhl_globals.PLAYER_IDS = scrapenhl_globals.PLAYER_IDS.merge(
-            gamedf, how = 'outer', on = ['ID', 'Name', 'Team', 'Pos', '#', 'Hand'])
+        scrapenhl_globals.PLAYER_IDS = pd.concat([scrapenhl_globals.PLAYER_IDS, gamedf]).drop_duplicates()
     newlength = len(scrapenhl_globals.PLAYER_IDS)
 
     ### Write to disk again immediately in case an error later crashes script
@@ -462,6 +970,21 @@ def update_player_ids_from_json(teamdata):
     if newlength > oldlength:
         scrapenhl_globals.write_player_id_file()
 
+def update_player_ids_from_json(teamdata):
+    """
+    Creates a data frame of player data from current game's json[liveData][boxscore] to update global PLAYER_IDS.
+
+    This method reads player ids, names, handedness, team, position, and number, and adds any new rows to PLAYER_IDS
+    (see update_player_ids_from_roster). If there are any changes to PLAYER_IDS, the dataframe gets written to disk
+    again.
+
+    Parameters
+    -----------
+    teamdata : dict
+        A json dict that is the result of api_page['liveData']['boxscore']['teams']
+    """
+    update_player_ids_from_roster(read_roster_from_json(teamdata))
+
 def update_quick_gamelog_from_json(data):
     """
     Creates a data frame of basic game data from current game's json to update global BASIC_GAMELOG.
@@ -1,7 +1,11 @@
-import scrapenhl_globals
-import scrape_game
-
-def scrape_games(season, games, force_overwrite = False, pause = 1, marker = 10):
+from scrapenhl.scrape import scrapenhl_globals
+from scrapenhl.scrape import fileio
+from scrapenhl.scrape import scrape_game
+from scrapenhl.scrape import season_aggregates
+from scrapenhl.scrape import metadata
+from scrapenhl.scrape import storage
+
+def scrape_games(season, games, force_overwrite = False, pause = 1, marker = 10, scheduled_only = True, refresh = None):
     """
     Scrapes the specified games.
 
@@ -18,8 +22,16 @@ def scrape_games(season, games, force_overwrite = False, pause = 1, marker = 10)
         The time to pause between requests to the NHL API. Defaults to 1 second
     marker : float or int
         The number of times to print progress. 10 will print every 10%; 20 every 5%.
+    scheduled_only : bool
+        If True, skips game ids that are not on the season schedule (see get_season_schedule) instead of requesting them
+    refresh : bool or None
+        Whether to fetch the schedule again if scheduled_only. None refreshes only if the saved schedule has games
+        that may have finished since it was fetched (see schedule_needs_refresh).
     """
     import time
+    if scheduled_only:
+        scheduled = set(get_season_schedule(season, refresh).Game)
+        games = [g for g in games if g in scheduled]
     games = sorted(list(games))
     marker_i = [len(games)//marker * i for i in range(marker)]
     marker_i[-1] = len(games) - 1
@@ -34,9 +46,12 @@ def scrape_games(season, games, force_overwrite = False, pause = 1, marker = 10)
     print('Done scraping games in', season)
 
 
-def scrape_season(season, startgame = None, endgame = None, force_overwrite = False, pause = 1):
+def scrape_season(season, startgame = None, endgame = None, force_overwrite = False, pause = 1,
+                  startdate = None, enddate = None, refresh = None):
     """
-    Scrapes games for the specified season.
+    Scrapes regular season and playoff games for the specified season.
+
+    Games are taken from the season schedule (see get_season_schedule), so only games that exist are requested.
 
     Parameters
     -----------
@@ -47,24 +62,28 @@ def scrape_season(season, startgame = None, endgame = None, force_overwrite = Fa
         scraped.
         This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
         The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
+    endgame : int
+        The game id at which scraping will end.
     force_overwrite : bool
         If True, will overwrite previously raw html files. If False, will not scrape if files already found.
     pause : float or int
         The time to pause between requests to the NHL API. Defaults to 1 second
+    startdate : str
+        If given, only games on or after this date (YYYY-MM-DD) are scraped.
+    enddate : str
+        If given, only games on or before this date (YYYY-MM-DD) are scraped.
+    refresh : bool or None
+        Whether to fetch the schedule again. None refreshes only if the saved schedule has games that may have
+        finished since it was fetched (see schedule_needs_refresh).
     """
-    if season != 2012:
-        games = [20000 + x for x in range(1, 1231)]
-    else:
-        games = [20000 + x for x in range(1, 721)]
-    for round in range(1, 5):
-        for series in range(1, 8//round + 1):
-            for game in range(1, 8):
-                games.append(int('30{0:d}{1:d}{2:d}'.format(round, series, game)))
+    games = get_scheduled_games(season, startdate, enddate, final_only = True, gametypes = ('R', 'P'),
+                                refresh = refresh)
     if startgame is not None:
         games = [g for g in games if g >= startgame]
     if endgame is not None:
         games = [g for g in games if g <= endgame]
-    scrape_games(season, games, force_overwrite, pause, 10)
+    ### The schedule was just refreshed if needed
+    scrape_games(season, games, force_overwrite, pause, 10, refresh = False)
 
 def get_team_pbplog_filename(season, team):
     return '{0:s}/{1:d}/{2:s}_pbp.feather'.format(scrapenhl_globals.SAVE_FOLDER, season, team)
@@ -72,83 +91,347 @@ def get_team_pbplog_filename(season, team):
 def get_team_toilog_filename(season, team):
     return '{0:s}/{1:d}/{2:s}_toi.feather'.format(scrapenhl_globals.SAVE_FOLDER, season, team)
 
-def update_teamlogs(season, force_overwrite = False):
+### Minimum number of slot columns per team in team toi logs. Logs are streamed, so every game in a log needs the same
+### columns; update_teamlogs widens them if any game has more slots.
+TOILOG_SLOTS = 8
+TOILOG_STATE_COLUMNS = ['TeamSkaters', 'OppSkaters', 'TeamGoaliePulled', 'OppGoaliePulled', 'Strength',
+                        'TeamScore', 'OppScore', 'ScoreDiff']
 
-    teams = set(
-        scrapenhl_globals.BASIC_GAMELOG.query('Season == {0:d}'.format(season))['Team'].value_counts().index())
+def get_toilog_schema(team, slots = TOILOG_SLOTS):
+    """
+    Returns the arrow schema of the team toi log.
 
-    ### List files in correct format
-    import os
-    allfiles = os.listdir(scrapenhl_globals.get_season_folder(season))
+    Parameters
+    -----------
+    team : str
+        Team abbreviation. Team player columns are [Team]1-N and opponent player columns are Opp1-N.
+    slots : int
+        N, the number of slot columns per team
+
+    Returns
+    --------
+    pyarrow.Schema
+        The schema
+    """
+    import pyarrow as pa
+    fields = [pa.field('Game', pa.int32()), pa.field('Time', pa.int32())]
+    fields += [pa.field('{0:s}{1:d}'.format(team, i), pa.float64()) for i in range(1, slots + 1)]
+    fields += [pa.field('Opp{0:d}'.format(i), pa.float64()) for i in range(1, slots + 1)]
+    fields += [pa.field(col, pa.int8()) for col in TOILOG_STATE_COLUMNS]
+    return pa.schema(fields)
+
+def get_toi_slot_columns(columns, team):
+    """
+    Splits the player slot columns of a parsed toi dataframe into this team's and the opponent's
+
+    Parameters
+    -----------
+    columns : list of str
+        Columns of the result of scrape_game.get_parsed_shifts
+    team : str
+        Team abbreviation
+
+    Returns
+    --------
+    tuple
+        (list of team slot columns, list of opponent slot columns)
+    """
+    teamcols = [c for c in columns if str(c)[:len(team)] == team and str(c)[len(team):].isdigit()]
+    oppcols = [c for c in columns if str(c)[-1].isdigit() and c not in teamcols]
+    return teamcols, oppcols
+
+def get_team_toi(df, season, game, team, ishome, slots = TOILOG_SLOTS):
+    """
+    Converts a game's parsed toi dataframe to the team toi log format, from this team's perspective.
+
+    Parameters
+    -----------
+    df : pandas df
+        The result of scrape_game.get_parsed_shifts
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    team : str
+        Team abbreviation
+    ishome : bool
+        Whether team is the home team in this game
+    slots : int
+        Number of slot columns per team. Must be at least the number of slots either team has in this game.
+
+    Returns
+    --------
+    pandas df
+        Dataframe with the columns in get_toilog_schema
+    """
+    import numpy as np
+    import pandas as pd
+    us, them = ('Home', 'Road') if ishome else ('Road', 'Home')
+
+    teamcols, oppcols = get_toi_slot_columns(df.columns, team)
+    if max(len(teamcols), len(oppcols)) > slots:
+        raise ValueError('{0:d} {1:d} has {2:d} slots per team; team log only has {3:d}'.format(
+            season, game, max(len(teamcols), len(oppcols)), slots))
+
+    ### Columns for players are labeled [Team]1-N, [OppTeam]1-N, so changing opp team names to just 'Opp'
+    newdf = {'Game': np.full(len(df.index), game, dtype = np.int32), 'Time': df.Time.to_numpy(dtype = np.int32)}
+    for i in range(slots):
+        newdf['{0:s}{1:d}'.format(team, i + 1)] = df[teamcols[i]].to_numpy(dtype = float) \
+            if i < len(teamcols) else np.full(len(df.index), np.nan)
+    for i in range(slots):
+        newdf['Opp{0:d}'.format(i + 1)] = df[oppcols[i]].to_numpy(dtype = float) \
+            if i < len(oppcols) else np.full(len(df.index), np.nan)
+    for col in ('Skaters', 'GoaliePulled', 'Score'):
+        newdf['Team' + col] = df[us + col].to_numpy(dtype = np.int8)
+        newdf['Opp' + col] = df[them + col].to_numpy(dtype = np.int8)
+    newdf['Strength'] = (10 * newdf['TeamSkaters'] + newdf['OppSkaters']).astype(np.int8)
+    newdf['ScoreDiff'] = (newdf['TeamScore'] - newdf['OppScore']).astype(np.int8)
+    return pd.DataFrame(newdf)[get_toilog_schema(team, slots).names]
+
+def update_teamlogs(season, force_overwrite = False, max_buffer_bytes = 64 * 1024 * 1024):
+    """
+    Updates the team toi logs for this season with games that have been parsed but are not in the logs yet.
+
+    Logs are built as a stream: each game is read once, converted for both teams, and written to the teams' logs as
+    arrow record batches (feather v2 format). Existing log contents are copied over one batch at a time from memory-mapped
+    files. So memory use depends on max_buffer_bytes, not on the number of games in the season.
 
-    pbpfiles = {int(x[:5]): x for x in allfiles if x[-12:] == '_parsed.zlib'}
-    toifiles = {int(x[:5]): x for x in allfiles if x[-19:] == '_shifts_parsed.zlib'}
+    Logs have as many slot columns as the most crowded game in them (at least TOILOG_SLOTS), so no slots are dropped.
+    Before writing, the column names of the games to add are read to size the logs; existing logs are widened with
+    empty slots if needed.
 
-    ### If force overwrite is false, read current log and see which games are already included
-    games_already_done = set()
+    The pbp logs are not built yet, since parsed pbp is not written yet (see scrape_game.read_events_from_json).
 
-    import feather
-    import zlib
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    force_overwrite : bool
+        If True, rebuilds logs from scratch. If False, only adds games not already in the logs.
+    max_buffer_bytes : int
+        Approximate memory ceiling for rows waiting to be written, shared among all teams.
+    """
+    import os
+    import pandas as pd
+    import pyarrow as pa
+
+    gamelog = scrapenhl_globals.BASIC_GAMELOG
+    gamelog = gamelog[gamelog.Season == season]
+    teams = sorted(set(gamelog.Home) | set(gamelog.Away))
+    if len(teams) == 0:
+        return
+    team_buffer_bytes = max_buffer_bytes // len(teams)
+
+    writers = {}
+    tmpnames = {}
+    buffers = {}
+    games_already_done = {team: set() for team in teams}
+
+    def flush(team):
+        if len(buffers[team]) > 0:
+            df = pd.concat(buffers[team], ignore_index = True)
+            writers[team].write_table(pa.Table.from_pandas(df, schema = get_toilog_schema(team, slots),
+                                                           preserve_index = False))
+            buffers[team] = []
+
+    ### Only one process updates a season's logs at a time. Readers keep their snapshot of the old logs (see
+    ### get_team_toilog) until each log is replaced.
+    with fileio.file_lock(get_team_toilog_filename(season, 'all')):
+        ### First pass: which games each log has and needs, and how many slots the logs need
+        slots = TOILOG_SLOTS
+        if not force_overwrite:
+            for team in teams:
+                filename = get_team_toilog_filename(season, team)
+                if os.path.exists(filename):
+                    with pa.memory_map(filename) as source:
+                        reader = pa.ipc.open_file(source)
+                        slots = max(slots, sum(1 for name in reader.schema.names if name[:3] == 'Opp'
+                                               and name[3:].isdigit()))
+                        for i in range(reader.num_record_batches):
+                            games_already_done[team].update(reader.get_batch(i).column('Game').unique().to_pylist())
+
+        todo = []
+        for game, home, away in zip(gamelog.Game, gamelog.Home, gamelog.Away):
+            game = int(game)
+            gameteams = [(team, team == home) for team in (home, away) if game not in games_already_done[team]]
+            if len(gameteams) == 0 or not os.path.exists(scrape_game.get_parsed_shifts_save_filename(season, game)):
+                continue
+            columns = scrape_game.get_parsed_shifts_columns(season, game)
+            if 'HomeSkaters' not in columns:
+                print('Skipping', season, game, 'in team logs; reparse it first')
+                continue
+            slots = max([slots] + [len(cols) for cols in get_toi_slot_columns(columns, home)])
+            todo.append((game, gameteams))
 
-    for team in teams:
-        teamgames = scrapenhl_globals.BASIC_GAMELOG.query('Season == {0:d} & (Home == "{1:s} | Away == {1:s})'.format(
-            season, team))['Game']
         try:
-            current_pbp = feather.read_dataframe(get_team_pbplog_filename(season, team))
-            games_already_done = {x for x in current_pbp.Game}
-        except FileNotFoundError:
-            current_pbp = None
-            games_already_done = set()
+            for team in teams:
+                filename = get_team_toilog_filename(season, team)
+                schema = get_toilog_schema(team, slots)
+                tmpnames[team] = fileio.get_temp_filename(filename)
+                writers[team] = pa.ipc.new_file(tmpnames[team], schema)
+                buffers[team] = []
+                if len(games_already_done[team]) > 0:
+                    ### Copy current log batch by batch, adding empty slot columns if the log is being widened
+                    with pa.memory_map(filename) as source:
+                        reader = pa.ipc.open_file(source)
+                        for i in range(reader.num_record_batches):
+                            batch = reader.get_batch(i)
+                            if batch.schema.names != schema.names:
+                                batch = pa.RecordBatch.from_arrays(
+                                    [batch.column(f.name) if f.name in batch.schema.names
+                                     else pa.nulls(batch.num_rows, f.type) for f in schema], schema = schema)
+                            writers[team].write_batch(batch)
+
+            for game, gameteams in todo:
+                df = scrape_game.get_parsed_shifts(season, game, use_cache = False)
+                for team, ishome in gameteams:
+                    buffers[team].append(get_team_toi(df, season, game, team, ishome, slots))
+                    if sum(int(x.memory_usage().sum()) for x in buffers[team]) > team_buffer_bytes:
+                        flush(team)
+
+            for team in teams:
+                flush(team)
+                writers.pop(team).close()
+                fileio.commit_temp_file(tmpnames.pop(team), get_team_toilog_filename(season, team))
+        finally:
+            ### On errors, leave the old logs in place and drop the partial ones
+            for team, writer in writers.items():
+                writer.close()
+            for tmpname in tmpnames.values():
+                if os.path.exists(tmpname):
+                    os.remove(tmpname)
+
+def get_team_toilog(season, team, columns = None):
+    """
+    Returns a team's toi log for this season, as one consistent snapshot even while update_teamlogs is running
 
-        dflist = []
-        if not force_overwrite:
-            dflist.append(current_pbp)
-            teamgames = {g for g in teamgames if g not in games_already_done}
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    team : str
+        Team abbreviation
+    columns : list of str or None
+        Columns to read. None reads all.
+
+    Returns
+    --------
+    pandas df
+        The log (see get_toilog_schema)
+    """
+    return fileio.read_feather(get_team_toilog_filename(season, team), columns)
 
-        if force_overwrite:
-            for game in teamgames:
-                r = open(scrape_game.get_parsed_save_filename(season, game), 'r')
-                page = r.read()
-                r.close()
+def get_season_rosters_filename(season):
+    """
+    Returns the save file name of the season's combined roster table
 
-                df = zlib.decompress(zlib)
-                df = df.assign(Game = game)
-                dflist.append(df)
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
 
-        import pandas as pd
-        new_pbp = pd.concat(dflist)
-        feather.write_dataframe(new_pbp, get_team_pbplog_filename(season, team))
+    Returns
+    --------
+    str
+        file name, SAVE_FOLDER/Season/rosters.feather
+    """
+    return '{0:s}rosters.feather'.format(scrapenhl_globals.get_season_folder(season))
 
-        try:
-            current_toi = feather.read_dataframe(get_team_toilog_filename(season, team))
-            games_already_done = {x for x in current_toi.Game}
-        except FileNotFoundError:
-            current_toi = None
-            games_already_done = set()
+def get_season_rosters(season):
+    """
+    Returns all game rosters for this season in one table.
 
-        dflist = []
-        if not force_overwrite:
-            dflist.append(current_toi)
-            teamgames = {g for g in teamgames if g not in games_already_done}
-
-        if force_overwrite:
-            for game in teamgames:
-                r = open(scrape_game.get_parsed_shifts_save_filename(season, game), 'r')
-                page = r.read()
-                r.close()
-
-                df = zlib.decompress(zlib)
-                ### Columns for players are labeled [Team]1-6, [OppTeam]1-6, so changing opp team names to just 'Opp'
-                oppnamecolumns = [x for x in df.columns if x[:3] != team]
-                oppname = x[0][:3]
-                df.rename(columns={'{0:s}{1:d}'.format(oppname, i): 'Opp{0:d}'.format(i) for i in range(1, 7)},
-                          inplace=True)
-                df = df.assign(Game = game)
-                dflist.append(df)
-
-        import pandas as pd
-        new_toi = pd.concat(dflist)
-        feather.write_dataframe(new_toi, get_team_toilog_filename(season, team))
+    The table is saved next to the per-game roster sidecars, and grows as games are parsed: sidecars for games not in
+    the table yet are read and added, and the table is saved again. So each sidecar is read only once.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+
+    Returns
+    --------
+    pandas df
+        Dataframe with columns Game, ID, Name, Team, Pos, #, and Hand
+    """
+    import os
+    import pandas as pd
+    filename = get_season_rosters_filename(season)
+    folder = scrapenhl_globals.get_season_folder(season)
+    if not os.path.exists(folder):
+        return pd.DataFrame({'Game': [], 'ID': [], 'Name': [], 'Team': [], 'Pos': [], '#': [], 'Hand': []})
+
+    with fileio.file_lock(filename):
+        if os.path.exists(filename):
+            rosters = fileio.read_feather(filename)
+        else:
+            rosters = pd.DataFrame({'Game': pd.Series([], dtype = 'int64'), 'ID': [], 'Name': [], 'Team': [],
+                                    'Pos': [], '#': pd.Series([], dtype = 'int64'), 'Hand': []})
+        done = set(rosters.Game)
+        new = [int(x[:5]) for x in os.listdir(folder) if x[-15:] == '_roster.feather' and int(x[:5]) not in done]
+        if len(new) > 0:
+            new = [fileio.read_feather(scrape_game.get_roster_save_filename(season, game)).assign(Game = game)
+                   for game in sorted(new)]
+            rosters = pd.concat([rosters] + new, ignore_index = True)[['Game', 'ID', 'Name', 'Team', 'Pos', '#',
+                                                                         'Hand']]
+            fileio.write_feather(rosters, filename)
+    return rosters
+
+def rebuild_player_id_file(seasons = None):
+    """
+    Rebuilds global PLAYER_IDS from the season roster tables (see get_season_rosters), and writes it to disk.
+
+    Names, positions, and handedness are corrected again from the metadata cache (see
+    metadata.update_id_tables_from_metadata), without fetching anything.
+
+    Parameters
+    -----------
+    seasons : iterable of ints or None
+        Seasons to include. None means 2007 through MAX_SEASON.
+    """
+    import pandas as pd
+    if seasons is None:
+        seasons = range(2007, scrapenhl_globals.MAX_SEASON + 1)
+
+    ### Dedupe within each season first, so the final concat is small
+    rosters = [get_season_rosters(season).drop(columns = 'Game').drop_duplicates() for season in seasons]
+    rosters = [df for df in rosters if len(df.index) > 0]
+    if len(rosters) == 0:
+        print('No roster files found')
+        return
+    scrapenhl_globals.PLAYER_IDS = pd.concat(rosters, ignore_index = True).drop_duplicates()
+    ### Sidecars hold names as they appeared in boxscores, so apply the cached metadata corrections again. This also
+    ### writes the table.
+    metadata.update_id_tables_from_metadata(refresh = False)
+
+def get_name_variants(seasons = None):
+    """
+    Counts games for each player ID and name spelling, from the season roster tables (see get_season_rosters).
+
+    Parameters
+    -----------
+    seasons : iterable of ints or None
+        Seasons to include. None means 2007 through MAX_SEASON.
+
+    Returns
+    --------
+    pandas df
+        One row per (ID, Name) with columns ID, Name, Games, and LastGame (season * 100000 + game), for use with
+        scrapenhl_globals.write_correct_playername_file
+    """
+    import pandas as pd
+    if seasons is None:
+        seasons = range(2007, scrapenhl_globals.MAX_SEASON + 1)
+
+    rosters = []
+    for season in seasons:
+        roster = get_season_rosters(season)[['Game', 'ID', 'Name']].drop_duplicates()
+        rosters.append(roster.assign(GameKey = season * 100000 + roster.Game.astype('int64')))
+
+    if sum(len(df.index) for df in rosters) == 0:
+        return pd.DataFrame({'ID': [], 'Name': [], 'Games': [], 'LastGame': []})
+    df = pd.concat(rosters, ignore_index = True)
+    return df.groupby(['ID', 'Name'], as_index = False).agg(Games = ('GameKey', 'size'), LastGame = ('GameKey', 'max'))
 
 def update_playerlog():
     pass
@@ -157,10 +440,162 @@ def get_season_schedule_url(season):
     return 'https://statsapi.web.nhl.com/api/v1/schedule?startDate={0:d}-09-01&endDate={1:d}-06-25'.format(season,
                                                                                                            season + 1)
 
-def parse_games(season, games, force_overwrite = False, marker = 10):
+def get_season_schedule_filename(season):
+    return '{0:s}{1:d}/schedule.feather'.format(scrapenhl_globals.SAVE_FOLDER, season)
+
+def schedule_needs_refresh(schedule, today = None):
+    """
+    Checks whether a saved schedule may be out of date: it has games dated today or earlier that weren't final yet
+    when it was fetched. Playoff games added as rounds progress are also picked up this way, since the schedule of a
+    season in progress always has such games.
+
+    Parameters
+    -----------
+    schedule : pandas df
+        The result of get_season_schedule
+    today : str or None
+        The date (YYYY-MM-DD) to compare to. None means today, in UTC.
+
+    Returns
+    --------
+    bool
+        True if the schedule should be fetched again
+    """
+    if today is None:
+        import datetime
+        today = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+    return bool(((schedule.Status != 'Final') & (schedule.Date <= today)).any())
+
+def get_season_schedule(season, refresh = None):
+    """
+    Returns the season schedule, reading it from disk if it was already fetched and is still current.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    refresh : bool or None
+        If True, fetches the schedule from the NHL API again (e.g. to pick up newly completed games) and saves it.
+        If False, uses the saved schedule if there is one. If None, fetches again only if the saved schedule has games
+        that may have finished since (see schedule_needs_refresh).
+
+    Returns
+    --------
+    pandas df
+        One row per scheduled game, with columns Game, Date (YYYY-MM-DD), Type (e.g. R, P, PR), Status (e.g. Final,
+        Preview), Home, and Away (team IDs), sorted by Game
+    """
+    import os.path
+    filename = get_season_schedule_filename(season)
+    if refresh is not True and os.path.exists(filename):
+        schedule = fileio.read_feather(filename)
+        if refresh is False or not schedule_needs_refresh(schedule):
+            return schedule
+
+    import urllib.request
+    import json
+    with urllib.request.urlopen(get_season_schedule_url(season)) as reader:
+        jsonpage = json.loads(reader.read().decode('latin-1'))
+
+    rows = {'Game': [], 'Date': [], 'Type': [], 'Status': [], 'Home': [], 'Away': []}
+    for gameday in jsonpage['dates']:
+        for game in gameday['games']:
+            ### gamePk is [season][game], e.g. 2016020001. Skip games from other seasons in the date range.
+            if int(str(game['gamePk'])[:4]) != season:
+                continue
+            rows['Game'].append(int(str(game['gamePk'])[-5:]))
+            rows['Date'].append(gameday['date'])
+            rows['Type'].append(game['gameType'])
+            rows['Status'].append(game['status']['abstractGameState'])
+            rows['Home'].append(game['teams']['home']['team']['id'])
+            rows['Away'].append(game['teams']['away']['team']['id'])
+
+    import pandas as pd
+    schedule = pd.DataFrame(rows).drop_duplicates(subset = 'Game', keep = 'last')
+    schedule = schedule.sort_values(by = 'Game').reset_index(drop = True)
+    if not os.path.exists(scrapenhl_globals.get_season_folder(season)):
+        scrapenhl_globals.create_season_folder(season)
+    fileio.write_feather(schedule, filename)
+    return schedule
+
+def get_scheduled_games(season, startdate = None, enddate = None, final_only = False, gametypes = None,
+                        refresh = None):
+    """
+    Returns game ids from the season schedule, optionally filtered by date, status, and game type.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    startdate : str
+        If given, only games on or after this date (YYYY-MM-DD).
+    enddate : str
+        If given, only games on or before this date (YYYY-MM-DD).
+    final_only : bool
+        If True, only completed games.
+    gametypes : iterable of str or None
+        If given, only these game types, e.g. ('R', 'P') for regular season and playoffs.
+    refresh : bool or None
+        If True, fetches the schedule from the NHL API again. If None, only if it may be out of date (see
+        get_season_schedule).
+
+    Returns
+    --------
+    list of int
+        Sorted game ids
+    """
+    schedule = get_season_schedule(season, refresh)
+    mask = schedule.Game == schedule.Game
+    if startdate is not None:
+        mask &= schedule.Date >= startdate
+    if enddate is not None:
+        mask &= schedule.Date <= enddate
+    if final_only:
+        mask &= schedule.Status == 'Final'
+    if gametypes is not None:
+        mask &= schedule.Type.isin(list(gametypes))
+    return [int(g) for g in schedule.Game[mask]]
+
+def get_stale_games(season, games, stages = None):
+    """
+    Checks which of the specified games have parsed files that are missing or out of date with the current parser.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    games : iterable of ints (e.g. list)
+        The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
+    stages : iterable of str or None
+        Stages to check, from scrape_game.PARSER_VERSIONS. None means all stages.
+
+    Returns
+    --------
+    pandas df
+        One row per stale (game, stage), with columns Game, Stage, and Status ('missing', 'old version', or
+        'schema changed')
+    """
+    if stages is None:
+        stages = scrape_game.PARSER_VERSIONS.keys()
+    rows = {'Game': [], 'Stage': [], 'Status': []}
+    for game in sorted(games):
+        for stage in stages:
+            status = scrape_game.get_parsed_stage_status(season, game, stage)
+            if status != 'current':
+                rows['Game'].append(game)
+                rows['Stage'].append(stage)
+                rows['Status'].append(status)
+
+    import pandas as pd
+    return pd.DataFrame(rows)
+
+def parse_games(season, games, force_overwrite = False, marker = 10, stages = None, dry_run = False):
     """
         Parses the specified games.
 
+        Only games with missing or out-of-date parsed files are parsed (see get_stale_games), and only for the stages
+        that are stale.
+
         Parameters
         -----------
         season : int
@@ -169,50 +604,201 @@ def parse_games(season, games, force_overwrite = False, marker = 10):
             The game id. This can range from 20001 to 21230 for regular season, and 30111 to 30417 for playoffs.
             The preseason, all-star game, Olympics, and World Cup also have game IDs that can be provided.
         force_overwrite : bool
-            If True, will overwrite previously parsed files. If False, will not parise if files already found.
+            If True, will overwrite previously parsed files. If False, will not parse if files are up to date.
         marker : float or int
             The number of times to print progress. 10 will print every 10%; 20 every 5%.
+        stages : iterable of str or None
+            Stages to parse, from scrape_game.PARSER_VERSIONS. None means all stages.
+        dry_run : bool
+            If True, prints how many games would be parsed per stage and why, and parses nothing.
+
+        Returns
+        -------
+        pandas df
+            The stale games and stages (see get_stale_games). Not computed (None) when force_overwrite is True.
         """
-    games = sorted(list(games))
+    stale = None
+    if force_overwrite:
+        todo = {game: stages for game in games}
+    else:
+        stale = get_stale_games(season, games, stages)
+        todo = {game: set(df.Stage) for game, df in stale.groupby('Game')}
+
+    if dry_run:
+        if stale is None:
+            print('Would parse all', len(todo), 'games in', season)
+        else:
+            print('Would parse', len(todo), 'of', len(set(games)), 'games in', season)
+            if len(stale.index) > 0:
+                print(stale.groupby(['Stage', 'Status']).size().to_string())
+        return stale
+
+    games = sorted(todo.keys())
+    if len(games) == 0:
+        print('No games to parse in', season)
+        return stale
     marker_i = [len(games) // marker * i for i in range(marker)]
     marker_i[-1] = len(games) - 1
     marker_i_set = set(marker_i)
     for i in range(len(games)):
         game = games[i]
-        scrape_game.parse_game(season, game, force_overwrite)
+        scrape_game.parse_game(season, game, force_overwrite, todo[game])
         if i in marker_i_set:
+            season_aggregates.write_season_aggregates(season)
             print('Done through', season, game, ' ~ ', round((marker_i.index(i)) * 100 / marker), '%')
+    season_aggregates.write_season_aggregates(season)
+    ### Add the new games' roster sidecars to the season roster table
+    get_season_rosters(season)
     print('Done parsing games in', season)
+    return stale
 
-def autoupdate(season = scrapenhl_globals.MAX_SEASON):
+def autoupdate(season = scrapenhl_globals.MAX_SEASON, startdate = None):
     """
-    Scrapes unscraped games for the specified season.
+    Scrapes and parses unscraped games for the specified season.
 
-    This is a convenience function that finds the highest completed game in a year and scrapes up to that point only.
-    This reduces unnecessary requests for unplayed games.
+    This is a convenience function that refreshes the season schedule and scrapes completed games only.
+    This avoids requests for unplayed or nonexistent games. Games already scraped and parsed are skipped, so this
+    only does work for games since the last run.
 
     Parameters
     -----------
     season : int
         The season of the game. 2007-08 would be 2007.
+    startdate : str
+        If given, only games on or after this date (YYYY-MM-DD) are considered.
     """
-    import urllib.request
-    url = get_season_schedule_url(season)
-    with urllib.request.urlopen(url) as reader:
-        page = reader.read().decode('latin-1')
+    completed_games = get_scheduled_games(season, startdate, final_only = True, gametypes = ('R', 'P'),
+                                          refresh = True)
 
-    import json
-    jsonpage = json.loads(page)
-    completed_games = set()
+    scrape_games(season, completed_games, refresh = False)
+    parse_games(season, completed_games)
 
-    for gameday in jsonpage['dates']:
-        for game in gameday['games']:
-            if game['status']['abstractGameState'] == 'Final':
-                completed_games.add(int(str(game['gamePk'])[-5:]))
+def get_shard_games(season, shard, numshards, refresh = None):
+    """
+    Splits the season's completed games into contiguous ranges, one per shard, and returns this shard's games.
 
-    #scrape_games(season, completed_games)
-    parse_games(season, completed_games)
+    Every shard must split the same schedule, or ranges will overlap or leave gaps; backfill_shard uses the schedule
+    pushed by prepare_backfill, with refresh = False.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    shard : int
+        This shard's number, from 0 to numshards - 1
+    numshards : int
+        The number of shards (e.g. nodes)
+    refresh : bool or None
+        Whether to fetch the schedule again (see get_season_schedule)
+
+    Returns
+    --------
+    list of int
+        This shard's game ids
+    """
+    games = get_scheduled_games(season, final_only = True, gametypes = ('R', 'P'), refresh = refresh)
+    size = -(-len(games) // numshards)
+    return games[shard * size:(shard + 1) * size]
+
+def prepare_backfill(season, store = None):
+    """
+    Fetches the season schedule and pushes it to the shared store, so every shard splits the same list of games. Run
+    this on one node, without SCRAPENHL_SHARD set, before starting backfill_shard on any node.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    store : LocalStorage or S3Storage or None
+        The shared store. If None, uses storage.get_storage().
+    """
+    if scrapenhl_globals.SHARD is not None:
+        raise ValueError('Run prepare_backfill without SCRAPENHL_SHARD set')
+    if store is None:
+        store = storage.get_storage()
+    schedule = get_season_schedule(season, refresh = True)
+    storage.push_files(store, ['{0:d}/schedule.feather'.format(season)])
+    print('Pushed schedule for', season, 'with', (schedule.Status == 'Final').sum(), 'completed games')
+
+def backfill_shard(season, shard, numshards, store = None):
+    """
+    Scrapes and parses one shard of a season on this node, then pushes the results to the shared store.
+
+    Run prepare_backfill on one node first. Then run this with SCRAPENHL_SHARD set to the shard number, so that global
+    and aggregate tables are written to shard-specific files and nodes never write the same key. Afterwards, run
+    merge_backfill on one node.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    shard : int
+        This shard's number, from 0 to numshards - 1
+    numshards : int
+        The number of shards (e.g. nodes)
+    store : LocalStorage or S3Storage or None
+        The shared store. If None, uses storage.get_storage().
+    """
+    import os
+    if scrapenhl_globals.SHARD != str(shard):
+        raise ValueError('Set SCRAPENHL_SHARD={0:d} before importing scrapenhl'.format(shard))
+    if store is None:
+        store = storage.get_storage()
+
+    ### Use the same schedule on every node, never this node's own
+    schedulekey = '{0:d}/schedule.feather'.format(season)
+    if not store.exists(schedulekey):
+        raise ValueError('No schedule for {0:d} in the store; run prepare_backfill first'.format(season))
+    store.download_file(schedulekey, get_season_schedule_filename(season))
+
+    games = get_shard_games(season, shard, numshards, refresh = False)
+    scrape_games(season, games, refresh = False)
+    parse_games(season, games)
+
+    gameset = {str(g) for g in games}
+    folder = scrapenhl_globals.get_season_folder(season)
+    keys = ['{0:d}/{1:s}'.format(season, f) for f in os.listdir(folder)
+            if f[:5] in gameset or f.endswith('_{0:s}.feather'.format(scrapenhl_globals.SHARD))]
+    keys += [os.path.basename(scrapenhl_globals.get_global_table_filename(name))
+             for name in ('playerids', 'teamids', 'quickgamelog')]
+    storage.push_files(store, keys)
+    print('Pushed', len(keys), 'files for shard', shard, 'of', season)
+
+def merge_backfill(season, store = None):
+    """
+    Pulls all shards' files for a season from the shared store, merges the shard tables, builds team logs, and pushes
+    the merged tables back. Run this on one node, without SCRAPENHL_SHARD set.
 
-for season in range(2008, 2017):
-    autoupdate(season)
-#scrapenhl_globals.write_correct_playername_file()
\ No newline at end of file
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    store : LocalStorage or S3Storage or None
+        The shared store. If None, uses storage.get_storage().
+    """
+    import os
+    if scrapenhl_globals.SHARD is not None:
+        raise ValueError('Run merge_backfill without SCRAPENHL_SHARD set')
+    if store is None:
+        store = storage.get_storage()
+
+    storage.pull_files(store, '{0:d}/'.format(season))
+    storage.pull_files(store, '{0:d}/agg_'.format(season), force_overwrite = True)
+    for name in ('playerids', 'teamids', 'quickgamelog'):
+        storage.pull_files(store, name + '_', force_overwrite = True)
+
+    scrapenhl_globals.merge_shard_tables()
+    season_aggregates.merge_shard_aggregates(season)
+    update_teamlogs(season)
+
+    keys = [os.path.basename(scrapenhl_globals.get_global_table_filename(name))
+            for name in ('playerids', 'teamids', 'quickgamelog')]
+    folder = scrapenhl_globals.get_season_folder(season)
+    keys += ['{0:d}/{1:s}'.format(season, f) for f in os.listdir(folder)
+             if (f.startswith('agg_') and f.count('_') == 1 and f.endswith('.feather')) or f.endswith('_toi.feather')]
+    storage.push_files(store, keys)
+
+if __name__ == '__main__':
+    for season in range(2008, 2017):
+        autoupdate(season)
+#scrapenhl_globals.write_correct_playername_file(get_name_variants())
\ No newline at end of file
@@ -2,11 +2,58 @@
 File and folder paths, and other variables needed by all modules in this package.
 """
 
-SAVE_FOLDER = "/Users/muneebalam/PycharmProjects/scrapenhl/scrapenhl/scrape/"
-PLAYER_ID_FILE = "{0:s}playerids.feather".format(SAVE_FOLDER)
+import os
+from scrapenhl.scrape import fileio
+
+### Set SCRAPENHL_SAVE_FOLDER to save somewhere other than the package folder, e.g. a local work folder on each node
+SAVE_FOLDER = os.path.join(os.environ.get('SCRAPENHL_SAVE_FOLDER', os.path.dirname(os.path.abspath(__file__))), '')
+### Set SCRAPENHL_SHARD on each node of a sharded backfill, so nodes write their own copies of the global tables.
+### These are combined afterwards with merge_shard_tables.
+SHARD = os.environ.get('SCRAPENHL_SHARD')
+
+def get_global_table_filename(name, shard = SHARD):
+    """
+    Returns the file name of a global table, e.g. playerids
+
+    Parameters
+    -----------
+    name : str
+        The table name, e.g. 'playerids', 'teamids', 'quickgamelog'
+    shard : str or None
+        If given, the shard's own copy of the table
+
+    Returns
+    -------
+    str
+        SAVE_FOLDER/name.feather, or SAVE_FOLDER/name_shard.feather
+    """
+    if shard is None:
+        return '{0:s}{1:s}.feather'.format(SAVE_FOLDER, name)
+    return '{0:s}{1:s}_{2:s}.feather'.format(SAVE_FOLDER, name, str(shard))
+
+def get_existing_global_table_filename(name):
+    """
+    Returns the file to read a global table from. A shard starts from the main table until it writes its own copy.
+
+    Parameters
+    -----------
+    name : str
+        The table name, e.g. 'playerids', 'teamids', 'quickgamelog'
+
+    Returns
+    -------
+    str or None
+        The shard's file if it exists, else the main file if it exists, else None
+    """
+    for filename in (get_global_table_filename(name), get_global_table_filename(name, None)):
+        if os.path.exists(filename):
+            return filename
+    return None
+
+PLAYER_ID_FILE = get_global_table_filename('playerids')
 CORRECTED_PLAYERNAMES_FILE = "{0:s}playernames.csv".format(SAVE_FOLDER)
-TEAM_ID_FILE = "{0:s}teamids.feather".format(SAVE_FOLDER)
-BASIC_GAMELOG_FILE = "{0:s}quickgamelog.feather".format(SAVE_FOLDER)
+TEAM_ID_FILE = get_global_table_filename('teamids')
+BASIC_GAMELOG_FILE = get_global_table_filename('quickgamelog')
 MAX_SEASON = 2016
 
 def create_season_folder(season):
@@ -52,16 +99,16 @@ def get_player_id_file():
     Pandas df
         The player id dataframe
     """
-    import feather
     import os.path
-    if not os.path.exists(PLAYER_ID_FILE):
+    filename = get_existing_global_table_filename('playerids')
+    if filename is None:
         print('Creating blank player ID file for future use')
         import pandas as pd
         PLAYER_IDS = pd.DataFrame({'ID': [], 'Name': [], 'Team': [], 'Pos': [], '#': [], 'Hand': []})
         #write_player_id_file()
         return PLAYER_IDS
     else:
-        return feather.read_dataframe(PLAYER_ID_FILE)
+        return fileio.read_feather(filename)
 
 def write_player_id_file():
     """
@@ -70,12 +117,8 @@ def write_player_id_file():
     This file maps player IDs to names, positions, handedness, teams, and jersey numbers. Using IDs is a way to avoid
     having to correct the numerous spelling inconsistencies in the data.
     """
-    import feather
-    try:
-        PLAYER_IDS.sort_values(by = "ID", inplace = True)
-    except UnboundLocalError:
-        PLAYER_IDS = get_player_id_file()
-        PLAYER_IDS.sort_values(by="ID", inplace=True)
+    global PLAYER_IDS
+    PLAYER_IDS = PLAYER_IDS.sort_values(by = "ID")
     PLAYER_IDS['#'] = PLAYER_IDS['#'].astype(int)
     PLAYER_IDS['ID'] = PLAYER_IDS['ID'].astype(str)
     PLAYER_IDS['Name'] = PLAYER_IDS['Name'].astype(str)
@@ -83,51 +126,81 @@ def write_player_id_file():
     PLAYER_IDS['Team'] = PLAYER_IDS['Team'].astype(str)
     PLAYER_IDS['Hand'] = PLAYER_IDS['Hand'].astype(str)
     PLAYER_IDS = PLAYER_IDS.drop_duplicates()
-    feather.write_dataframe(PLAYER_IDS, PLAYER_ID_FILE)
+    fileio.write_feather(PLAYER_IDS, PLAYER_ID_FILE)
 
-def write_correct_playername_file():
-    import pandas as pd
-    import os.path
+def get_canonical_names(variants, rule = 'most_frequent'):
+    """
+    Picks one name per player ID from all spellings seen
 
-    # Find duplicate names in player id df
-    counts = PLAYER_IDS.drop_duplicates(subset = ['ID', 'Name'])
-    counts = counts.groupby('ID').count()
+    Parameters
+    -----------
+    variants : pandas df
+        One row per (ID, Name) with columns ID, Name, Games (number of games seen with this name), and LastGame (a
+        sortable game key, e.g. season * 100000 + game)
+    rule : str
+        'most_frequent' picks the name seen in the most games, then the most recent. 'most_recent' picks the name seen
+        most recently, then the most frequent. Remaining ties go to the alphabetically first name.
 
-    singles = counts.query('Name == 1')
-    singles.reset_index(inplace=True)
-    singles.drop({'Name'}, axis=1, inplace=True)
+    Returns
+    --------
+    pandas df
+        One row per ID with columns ID and Name
+    """
+    if rule == 'most_frequent':
+        order = ['Games', 'LastGame']
+    elif rule == 'most_recent':
+        order = ['LastGame', 'Games']
+    else:
+        raise ValueError('rule must be most_frequent or most_recent, not {0:s}'.format(str(rule)))
+    variants = variants.sort_values(by = ['ID'] + order + ['Name'], ascending = [True, False, False, True])
+    return variants.drop_duplicates(subset = 'ID', keep = 'first')[['ID', 'Name']].reset_index(drop = True)
 
-    dupnames = dupnames.query('Name >= 2')
-    dupnames.reset_index(inplace = True)
-    dupnames.drop({'Name'}, axis = 1, inplace = True)
+def write_correct_playername_file(variants, rule = 'most_frequent'):
+    """
+    Writes the corrected player names file, with one name per player ID, without asking for input.
 
-    if len(dupnames.index) == 0:
-        PLAYER_IDS[['ID', 'Name']].to_csv(CORRECTED_PLAYERNAMES_FILE, index = False, encoding = 'latin-1')
+    A name is picked for each ID by rule (see get_canonical_names). Rows marked Manual = 1 in the existing
+    CORRECTED_PLAYERNAMES_FILE override the picked name; in files written before the Manual column existed, every row is
+    treated as an override. Other rows already in the file for IDs not in variants are kept, so variants can cover just
+    some seasons.
 
-    # Filter to those not in the corrected playernames file.
-    if os.path.exists(CORRECTED_PLAYERNAMES_FILE):
-        correct_names = pd.read_csv(CORRECTED_PLAYERNAMES_FILE)
-        # Identify what values are in TableB and not in TableA
-        key_diff = set(dupnames.ID).difference(correct_names.Key)
-        where_diff = dupnames.ID.isin(key_diff)
+    Parameters
+    -----------
+    variants : pandas df
+        Name spellings with game counts and last games, from scrape_season.get_name_variants. PLAYER_IDS can't stand in
+        for it: its rows are team, number, and position combinations, not games.
+    rule : str
+        'most_frequent' or 'most_recent'
 
-        dupnames = dupnames[where_diff]
-        if len(dupnames.index) == 0:
-            fulldf = pd.concat([correct_names, PLAYER_IDS[['ID', 'Name']]]).drop_duplicates()
-            fulldf.to_csv(CORRECTED_PLAYERNAMES_FILE, index=False, encoding='latin-1')
-    else:
-        correct_names = singles.merge(PLAYER_IDS[['ID', 'Name']], how = 'inner', on = 'ID')
+    Returns
+    --------
+    pandas df
+        The corrected names, with columns ID, Name, and Manual
+    """
+    import pandas as pd
+    import os.path
 
-    # Ask user to resolve remaining cases
-    ids = [x for x in dupnames.ID]
-    for i in range(len(ids)):
-        temp = PLAYER_IDS.query('ID == "{0:s}"'.format(ids[i]))
-        print(temp)
-        preferred = input("Enter the row number (1 to {0:d}) of the preferred name\t".format(len(temp.index)))
-        correct_names = pd.concat([correct_names, temp.iloc[preferred, :]])
+    variants = variants.assign(ID = variants.ID.astype(str))
 
-    # Write uniques of this df, player id singles, and player_ids to file
-    ### TODO also remake this method to work more intelligently
+    names = get_canonical_names(variants, rule).assign(Manual = 0)
+
+    ### Read and rewrite under one lock, so another process's corrections are not lost in between
+    with fileio.file_lock(CORRECTED_PLAYERNAMES_FILE):
+        if os.path.exists(CORRECTED_PLAYERNAMES_FILE):
+            existing = pd.read_csv(CORRECTED_PLAYERNAMES_FILE, dtype = {'ID': str}, encoding = 'latin-1')
+            if 'Manual' not in existing.columns:
+                existing = existing.assign(Manual = 1)
+            existing = existing[['ID', 'Name', 'Manual']].drop_duplicates(subset = 'ID', keep = 'last')
+            overrides = existing[existing.Manual == 1]
+            ### IDs outside variants keep the names picked earlier
+            kept = existing[(existing.Manual != 1) & ~existing.ID.isin(names.ID)]
+            names = pd.concat([names[~names.ID.isin(overrides.ID)], kept, overrides])
+        names = names.assign(Manual = names.Manual.astype(int))
+
+        names = names.sort_values(by = 'ID').reset_index(drop = True)
+        fileio.atomic_write(CORRECTED_PLAYERNAMES_FILE,
+                            lambda tmpname: names.to_csv(tmpname, index = False, encoding = 'latin-1'))
+    return names
 
 def get_team_id_file():
     """
@@ -142,16 +215,16 @@ def get_team_id_file():
     Pandas df
         The team id dataframe
     """
-    import feather
     import os.path
-    if not os.path.exists(TEAM_ID_FILE):
+    filename = get_existing_global_table_filename('teamids')
+    if filename is None:
         print('Creating blank team ID file for future use')
         import pandas as pd
         TEAM_IDS = pd.DataFrame({'ID': [], 'Name': [], 'Abbreviation': []})
         # write_player_id_file()
         return TEAM_IDS
     else:
-        return feather.read_dataframe(TEAM_ID_FILE)
+        return fileio.read_feather(filename)
 
 def write_team_id_file():
     """
@@ -159,9 +232,9 @@ def write_team_id_file():
 
     This file maps team IDs to names and abbreviations.
     """
-    import feather
-    PLAYER_IDS.sort_values(by="ID", inplace=True)
-    feather.write_dataframe(TEAM_IDS, TEAM_ID_FILE)
+    global TEAM_IDS
+    TEAM_IDS = TEAM_IDS.sort_values(by="ID")
+    fileio.write_feather(TEAM_IDS, TEAM_ID_FILE)
 
 def get_quick_gamelog_file():
     """
@@ -175,28 +248,52 @@ def get_quick_gamelog_file():
     Pandas df
         The game log dataframe
     """
-    import feather
     import os.path
-    if not os.path.exists(BASIC_GAMELOG_FILE):
+    filename = get_existing_global_table_filename('quickgamelog')
+    if filename is None:
         print('Creating blank game log file for future use')
         import pandas as pd
         df = pd.DataFrame({'Season': [], 'Game': [], 'Datetime': [], 'Venue': [],
                            'Home': [], 'HomeCoach': [], 'HomeScore': [],
                            'Away': [], 'AwayCoach': [], 'AwayScore': []})
-        write_quick_gamelog_file()
+        # write_quick_gamelog_file()
         return df
     else:
-        return feather.read_dataframe(BASIC_GAMELOG_FILE)
+        return fileio.read_feather(filename)
 
 def write_quick_gamelog_file():
     """
     Writes the game log dataframe (in global namespace) to disk in feather format
     """
-    import feather
-    BASIC_GAMELOG.sort_values(by = ['Season', 'Game'], inplace = True)
+    global BASIC_GAMELOG
+    BASIC_GAMELOG = BASIC_GAMELOG.sort_values(by = ['Season', 'Game'])
     BASIC_GAMELOG = BASIC_GAMELOG.drop_duplicates()
-    feather.write_dataframe(BASIC_GAMELOG, BASIC_GAMELOG_FILE)
+    fileio.write_feather(BASIC_GAMELOG, BASIC_GAMELOG_FILE)
+
+def merge_shard_tables():
+    """
+    Combines the global tables written by the shards of a backfill (see SHARD) into the main tables, and writes them.
+
+    Each shard's files are left in place, so running this again is safe.
+    """
+    import glob
+    import pandas as pd
+    global PLAYER_IDS, TEAM_IDS, BASIC_GAMELOG
+
+    def merge(name, sortby):
+        mainfile = get_global_table_filename(name, None)
+        files = [mainfile] if os.path.exists(mainfile) else []
+        files += sorted(f for f in glob.glob('{0:s}{1:s}_*.feather'.format(SAVE_FOLDER, name)) if f != mainfile)
+        if len(files) == 0:
+            return None
+        df = pd.concat([fileio.read_feather(f) for f in files], ignore_index = True).drop_duplicates()
+        df = df.sort_values(by = sortby).reset_index(drop = True)
+        fileio.write_feather(df, mainfile)
+        return df
 
+    PLAYER_IDS = merge('playerids', 'ID')
+    TEAM_IDS = merge('teamids', 'ID')
+    BASIC_GAMELOG = merge('quickgamelog', ['Season', 'Game'])
 
 PLAYER_IDS = get_player_id_file()
 BASIC_GAMELOG = get_quick_gamelog_file()
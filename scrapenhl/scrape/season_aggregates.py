@@ -0,0 +1,448 @@
+"""
+Season aggregate tables, kept up to date as games are parsed.
+
+There are three tables per season:
+
+- player: PlayerID, Team, GP, TOI, TOI5v5 (seconds)
+- team: Team, Strength (10 * own skaters + opponent skaters), TOI (seconds)
+- h2h: PlayerID, OppID, TOI (seconds the two were on ice against each other; stored in both directions)
+
+parse_game adds each newly parsed game's totals (and removes the old totals if a game is reparsed), so the tables never
+need a full recompute. In memory, totals are kept per key, so adding a game only touches the rows for that game's
+players and strengths. They are written to disk by write_season_aggregates; parse_games does this as it goes.
+rebuild_season_aggregates recomputes a season from all parsed files, to reconcile if anything was missed.
+
+A season's tables are written and read together under one lock (see get_aggregate_lock_filename), so a reader in
+another process never mixes tables from before and after a write. Tables are read again when the files on disk change,
+so a long-running process sees games parsed by another process. Only one process should parse a given season at a
+time, though: unsaved totals in memory are written over whatever is on disk.
+"""
+
+from scrapenhl.scrape import scrapenhl_globals
+from scrapenhl.scrape import fileio
+from scrapenhl.scrape import game_cache
+
+AGGREGATE_KEYS = {'player': ['PlayerID', 'Team'], 'team': ['Team', 'Strength'], 'h2h': ['PlayerID', 'OppID']}
+AGGREGATE_VALUES = {'player': ['GP', 'TOI', 'TOI5v5'], 'team': ['TOI'], 'h2h': ['TOI']}
+
+### Per season: {table: {key tuple: numpy array of values}} and 'games': set of game ids
+_TOTALS = {}
+### Per season: dataframes built from _TOTALS, until the next change
+_FRAMES = {}
+### Per season: stamps of the files on disk when last read or written (see game_cache.get_file_stamp)
+_STAMPS = {}
+_DIRTY = set()
+
+
+def get_aggregate_filename(season, table, shard = scrapenhl_globals.SHARD):
+    """
+    Returns the save file name of a season aggregate table
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    table : str
+        'player', 'team', 'h2h', or 'games' (the games included in the other tables)
+    shard : str or None
+        If given, the shard's own copy of the table (see scrapenhl_globals.SHARD)
+
+    Returns
+    --------
+    str
+        file name, SAVE_FOLDER/Season/agg_[table].feather or SAVE_FOLDER/Season/agg_[table]_[shard].feather
+    """
+    if shard is None:
+        return '{0:s}{1:d}/agg_{2:s}.feather'.format(scrapenhl_globals.SAVE_FOLDER, season, table)
+    return '{0:s}{1:d}/agg_{2:s}_{3:s}.feather'.format(scrapenhl_globals.SAVE_FOLDER, season, table, str(shard))
+
+
+def get_aggregate_lock_filename(season, shard = scrapenhl_globals.SHARD):
+    """
+    Returns the path whose lock covers all of a season's aggregate tables (see fileio.file_lock)
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    shard : str or None
+        If given, the shard's own copy of the tables
+
+    Returns
+    --------
+    str
+        SAVE_FOLDER/Season/agg_all.feather or SAVE_FOLDER/Season/agg_all_[shard].feather (this file is not written)
+    """
+    return get_aggregate_filename(season, 'all', shard)
+
+
+def _get_blank_tables():
+    """
+    Returns empty aggregate tables
+
+    Returns
+    --------
+    dict
+        table name: pandas df
+    """
+    import pandas as pd
+    columns = {'player': ['PlayerID', 'Team', 'GP', 'TOI', 'TOI5v5'], 'team': ['Team', 'Strength', 'TOI'],
+               'h2h': ['PlayerID', 'OppID', 'TOI'], 'games': ['Game']}
+    return {name: pd.DataFrame({col: pd.Series([], dtype = object if col == 'Team' else 'int64') for col in cols})
+            for name, cols in columns.items()}
+
+
+def _get_file_stamps(season):
+    """
+    Returns the stamps of this season's aggregate files on disk
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+
+    Returns
+    --------
+    tuple
+        One stamp per table (see game_cache.get_file_stamp), or None for tables not on disk
+    """
+    import os.path
+    stamps = []
+    for name in _get_blank_tables():
+        filename = get_aggregate_filename(season, name)
+        stamps.append(game_cache.get_file_stamp(filename) if os.path.exists(filename) else None)
+    return tuple(stamps)
+
+
+def _frames_to_totals(tables):
+    """
+    Converts aggregate tables to per-key totals
+
+    Parameters
+    -----------
+    tables : dict
+        'player', 'team', 'h2h', and 'games' dataframes
+
+    Returns
+    --------
+    dict
+        'player', 'team', and 'h2h': {key tuple: numpy array of values}, and 'games': set of game ids
+    """
+    import numpy as np
+    totals = {'games': {int(g) for g in tables['games'].Game}}
+    for name, keys in AGGREGATE_KEYS.items():
+        df = tables[name]
+        totals[name] = dict(zip(zip(*[df[k].tolist() for k in keys]),
+                                df[AGGREGATE_VALUES[name]].to_numpy(dtype = np.int64)))
+    return totals
+
+
+def _totals_to_frames(totals):
+    """
+    Converts per-key totals to aggregate tables, sorted by key
+
+    Parameters
+    -----------
+    totals : dict
+        The result of _frames_to_totals
+
+    Returns
+    --------
+    dict
+        'player', 'team', 'h2h', and 'games' dataframes
+    """
+    import numpy as np
+    import pandas as pd
+    tables = _get_blank_tables()
+    for name, keys in AGGREGATE_KEYS.items():
+        if len(totals[name]) == 0:
+            continue
+        df = pd.DataFrame({k: list(v) for k, v in zip(keys, zip(*totals[name].keys()))})
+        values = np.vstack(list(totals[name].values()))
+        for i, col in enumerate(AGGREGATE_VALUES[name]):
+            df[col] = values[:, i]
+        tables[name] = df.sort_values(by = keys).reset_index(drop = True)
+    tables['games'] = pd.DataFrame({'Game': pd.Series(sorted(totals['games']), dtype = 'int64')})
+    return tables
+
+
+def _get_totals(season):
+    """
+    Returns the in-memory totals for this season, reading them from disk the first time, and again whenever the files
+    on disk have changed and there are no unsaved changes in memory.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+
+    Returns
+    --------
+    dict
+        See _frames_to_totals
+    """
+    if season in _TOTALS and (season in _DIRTY or _STAMPS.get(season) == _get_file_stamps(season)):
+        return _TOTALS[season]
+
+    import os.path
+    tables = _get_blank_tables()
+    with fileio.file_lock(get_aggregate_lock_filename(season), shared = True):
+        for name in tables:
+            filename = get_aggregate_filename(season, name)
+            if os.path.exists(filename):
+                tables[name] = fileio.read_feather(filename)
+        _STAMPS[season] = _get_file_stamps(season)
+    _TOTALS[season] = _frames_to_totals(tables)
+    _FRAMES[season] = tables
+    return _TOTALS[season]
+
+
+def get_season_aggregates(season):
+    """
+    Returns the aggregate tables for this season, reading them from disk the first time and whenever another process
+    has written them since.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+
+    Returns
+    --------
+    dict
+        'player', 'team', 'h2h', and 'games' dataframes. Do not modify in place.
+    """
+    totals = _get_totals(season)
+    if season not in _FRAMES:
+        _FRAMES[season] = _totals_to_frames(totals)
+    return _FRAMES[season]
+
+
+def write_season_aggregates(season = None):
+    """
+    Writes changed aggregate tables to disk in feather format
+
+    Parameters
+    -----------
+    season : int or None
+        The season to write. None writes all seasons with changes.
+    """
+    seasons = [s for s in _DIRTY if season is None or s == season]
+    for s in seasons:
+        tables = get_season_aggregates(s)
+        with fileio.file_lock(get_aggregate_lock_filename(s)):
+            for name, df in tables.items():
+                fileio.write_feather(df, get_aggregate_filename(s, name), lock = False)
+            _STAMPS[s] = _get_file_stamps(s)
+        _DIRTY.discard(s)
+
+
+def is_game_included(season, game):
+    """
+    Checks whether this game is in the season aggregate tables
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+
+    Returns
+    --------
+    bool
+        True if the game's totals are included
+    """
+    return int(game) in _get_totals(season)['games']
+
+
+def get_game_aggregates(toi, homename, roadname):
+    """
+    Computes one game's contribution to the season aggregate tables
+
+    Parameters
+    -----------
+    toi : pandas df
+        Parsed toi dataframe with game state columns (see scrape_game.add_game_state_to_toi)
+    homename : str
+        Home team abbreviation
+    roadname : str
+        Road team abbreviation
+
+    Returns
+    --------
+    dict
+        'player', 'team', and 'h2h' dataframes
+    """
+    import numpy as np
+    import pandas as pd
+
+    even = ((toi.Strength == 55) & (toi.HomeGoaliePulled == 0) & (toi.RoadGoaliePulled == 0)).to_numpy()
+
+    def get_slots(team):
+        cols = [c for c in toi.columns if str(c)[:len(team)] == team and str(c)[len(team):].isdigit()]
+        return toi[cols].to_numpy(dtype = float)
+
+    slots = {homename: get_slots(homename), roadname: get_slots(roadname)}
+
+    players = []
+    for team, vals in slots.items():
+        onice = ~np.isnan(vals)
+        teamdf = pd.DataFrame({'PlayerID': vals[onice].astype(np.int64),
+                               'TOI5v5': np.repeat(even, vals.shape[1]).reshape(vals.shape)[onice].astype(int)})
+        teamdf = teamdf.groupby('PlayerID', as_index = False).agg(TOI = ('TOI5v5', 'size'), TOI5v5 = ('TOI5v5', 'sum'))
+        players.append(teamdf.assign(Team = team, GP = 1))
+    player = pd.concat(players, ignore_index = True)[['PlayerID', 'Team', 'GP', 'TOI', 'TOI5v5']]
+
+    hstrength = toi.Strength.to_numpy(dtype = int)
+    rstrength = 10 * toi.RoadSkaters.to_numpy(dtype = int) + toi.HomeSkaters.to_numpy(dtype = int)
+    team = pd.concat([pd.DataFrame({'Team': homename, 'Strength': hstrength}),
+                      pd.DataFrame({'Team': roadname, 'Strength': rstrength})], ignore_index = True)
+    team = team.groupby(['Team', 'Strength'], as_index = False).size().rename(columns = {'size': 'TOI'})
+
+    ### Every home slot against every road slot, each second
+    hvals = slots[homename][:, :, np.newaxis]
+    rvals = slots[roadname][:, np.newaxis, :]
+    hvals, rvals = np.broadcast_arrays(hvals, rvals)
+    both = ~np.isnan(hvals) & ~np.isnan(rvals)
+    h2h = pd.DataFrame({'PlayerID': hvals[both].astype(np.int64), 'OppID': rvals[both].astype(np.int64)})
+    h2h = h2h.groupby(['PlayerID', 'OppID'], as_index = False).size().rename(columns = {'size': 'TOI'})
+    h2h = pd.concat([h2h, h2h.rename(columns = {'PlayerID': 'OppID', 'OppID': 'PlayerID'})], ignore_index = True)
+
+    return {'player': player, 'team': team, 'h2h': h2h}
+
+
+def _add_to_tables(season, delta, sign):
+    """
+    Adds (sign = 1) or subtracts (sign = -1) a game's totals from the in-memory season totals. Only the keys in delta
+    are touched, and keys whose totals drop to zero are removed.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    delta : dict
+        The result of get_game_aggregates
+    sign : int
+        1 or -1
+    """
+    import numpy as np
+    totals = _get_totals(season)
+    for name, keys in AGGREGATE_KEYS.items():
+        table = totals[name]
+        df = delta[name]
+        values = sign * df[AGGREGATE_VALUES[name]].to_numpy(dtype = np.int64)
+        for key, value in zip(zip(*[df[k].tolist() for k in keys]), values):
+            total = table.get(key)
+            total = value if total is None else total + value
+            if total.any():
+                table[key] = total
+            else:
+                table.pop(key, None)
+    _FRAMES.pop(season, None)
+    _DIRTY.add(season)
+
+
+def update_season_aggregates(season, game, toi, homename, roadname, oldtoi = None):
+    """
+    Adds this game to the season aggregate tables, replacing its previous totals if it was already included
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    game : int
+        The game id.
+    toi : pandas df
+        Newly parsed toi dataframe with game state columns
+    homename : str
+        Home team abbreviation
+    roadname : str
+        Road team abbreviation
+    oldtoi : pandas df or None
+        The previously parsed toi dataframe, if the game is being reparsed
+    """
+    if is_game_included(season, game):
+        if oldtoi is None or 'Strength' not in oldtoi.columns:
+            print('Cannot remove old totals for', season, game, '; run rebuild_season_aggregates')
+            return
+        _add_to_tables(season, get_game_aggregates(oldtoi, homename, roadname), -1)
+    _add_to_tables(season, get_game_aggregates(toi, homename, roadname), 1)
+    ### After _add_to_tables, so the totals are marked changed and can't be reread from disk in between
+    _TOTALS[season]['games'].add(int(game))
+
+
+def rebuild_season_aggregates(season):
+    """
+    Recomputes the season aggregate tables from all parsed toi files, and writes them to disk.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    """
+    import os
+    import pandas as pd
+    from scrapenhl.scrape import scrape_game
+
+    gamelog = scrapenhl_globals.BASIC_GAMELOG
+    gamelog = gamelog[gamelog.Season == season]
+
+    deltas = {name: [] for name in AGGREGATE_KEYS}
+    games = []
+    for game, home, away in zip(gamelog.Game, gamelog.Home, gamelog.Away):
+        game = int(game)
+        if not os.path.exists(scrape_game.get_parsed_shifts_save_filename(season, game)):
+            continue
+        toi = scrape_game.get_parsed_shifts(season, game, use_cache = False)
+        if 'Strength' not in toi.columns:
+            print('Skipping', season, game, 'in aggregates; reparse it first')
+            continue
+        for name, df in get_game_aggregates(toi, home, away).items():
+            deltas[name].append(df)
+        games.append(game)
+
+    tables = _get_blank_tables()
+    for name, keys in AGGREGATE_KEYS.items():
+        if len(deltas[name]) > 0:
+            tables[name] = pd.concat(deltas[name], ignore_index = True).groupby(keys, as_index = False).sum()
+    tables['games'] = pd.DataFrame({'Game': pd.Series(games, dtype = 'int64')})
+    _TOTALS[season] = _frames_to_totals(tables)
+    _FRAMES.pop(season, None)
+    _DIRTY.add(season)
+    write_season_aggregates(season)
+
+
+def merge_shard_aggregates(season):
+    """
+    Adds the aggregate tables written by the shards of a backfill to the main tables, and writes them.
+
+    Run this where SCRAPENHL_SHARD is not set, after pulling the shards' files. Shards already merged are skipped, so
+    running this again is safe.
+
+    Parameters
+    -----------
+    season : int
+        The season of the game. 2007-08 would be 2007.
+    """
+    import glob
+    import os.path
+
+    prefix = os.path.basename(get_aggregate_filename(season, 'games', ''))[:-len('.feather')]
+    shards = sorted(os.path.basename(f)[len(prefix):-len('.feather')]
+                    for f in glob.glob(get_aggregate_filename(season, 'games', '*')))
+
+    for shard in shards:
+        with fileio.file_lock(get_aggregate_lock_filename(season, shard), shared = True):
+            shardtables = {name: fileio.read_feather(get_aggregate_filename(season, name, shard))
+                           for name in _get_blank_tables()}
+        shardgames = {int(g) for g in shardtables['games'].Game}
+        overlap = shardgames & _get_totals(season)['games']
+        if len(overlap) == len(shardgames):
+            continue
+        if len(overlap) > 0:
+            print('Shard', shard, 'overlaps games already included in', season, '; run rebuild_season_aggregates')
+            continue
+        _add_to_tables(season, shardtables, 1)
+        _TOTALS[season]['games'].update(shardgames)
+    write_season_aggregates(season)
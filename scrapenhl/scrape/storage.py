@@ -0,0 +1,150 @@
+"""
+Shared storage for multi-node backfills.
+
+Each node scrapes and parses into its own SAVE_FOLDER, then pushes its files to a shared store; a coordinator pulls
+them back and merges the shard tables. The store is either a directory (local disk or a shared mount) or an
+S3-compatible bucket (AWS, MinIO, ...). Keys are paths relative to SAVE_FOLDER, e.g. '2016/20001.zlib'.
+
+The store is chosen with the SCRAPENHL_STORAGE environment variable: a directory path, or s3://bucket/prefix. For
+S3-compatible servers other than AWS, set SCRAPENHL_S3_ENDPOINT as well, e.g. http://localhost:9000 for MinIO.
+S3 storage requires boto3.
+"""
+
+from scrapenhl.scrape import scrapenhl_globals
+from scrapenhl.scrape import fileio
+
+
+class LocalStorage(object):
+    """
+    Storage in a local or mounted directory
+    """
+
+    def __init__(self, root):
+        import os
+        self.root = os.path.join(root, '')
+
+    def exists(self, key):
+        import os.path
+        return os.path.exists(self.root + key)
+
+    def list_keys(self, prefix = ''):
+        import os
+        keys = []
+        for folder, _, files in os.walk(self.root):
+            for f in files:
+                key = os.path.relpath(os.path.join(folder, f), self.root).replace(os.sep, '/')
+                ### Skip writes in progress and lock files (see fileio)
+                if key.startswith(prefix) and not key.endswith(('.tmp', '.lock')):
+                    keys.append(key)
+        return sorted(keys)
+
+    def upload_file(self, filename, key):
+        import shutil
+        ### Copy to a temporary name first so readers never see a partial file
+        fileio.atomic_write(self.root + key, lambda tmpname: shutil.copyfile(filename, tmpname), lock = False)
+
+    def download_file(self, key, filename):
+        import shutil
+        fileio.atomic_write(filename, lambda tmpname: shutil.copyfile(self.root + key, tmpname), lock = False)
+
+
+class S3Storage(object):
+    """
+    Storage in an S3-compatible bucket
+    """
+
+    def __init__(self, bucket, prefix = '', endpoint_url = None):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError('S3 storage requires boto3')
+        self.client = boto3.client('s3', endpoint_url = endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') != '' else ''
+
+    def exists(self, key):
+        import botocore.exceptions
+        try:
+            self.client.head_object(Bucket = self.bucket, Key = self.prefix + key)
+            return True
+        except botocore.exceptions.ClientError:
+            return False
+
+    def list_keys(self, prefix = ''):
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket = self.bucket, Prefix = self.prefix + prefix):
+            keys += [obj['Key'][len(self.prefix):] for obj in page.get('Contents', [])]
+        return sorted(keys)
+
+    def upload_file(self, filename, key):
+        ### S3 puts are atomic, so no temporary key is needed
+        self.client.upload_file(filename, self.bucket, self.prefix + key)
+
+    def download_file(self, key, filename):
+        import os
+        os.makedirs(os.path.dirname(filename), exist_ok = True)
+        self.client.download_file(self.bucket, self.prefix + key, filename)
+
+
+def get_storage(url = None):
+    """
+    Returns the shared store
+
+    Parameters
+    -----------
+    url : str or None
+        A directory path, or s3://bucket/prefix. If None, uses the SCRAPENHL_STORAGE environment variable.
+
+    Returns
+    --------
+    LocalStorage or S3Storage
+        The store
+    """
+    import os
+    if url is None:
+        url = os.environ.get('SCRAPENHL_STORAGE')
+    if url is None:
+        raise ValueError('No storage given; set SCRAPENHL_STORAGE to a directory or s3://bucket/prefix')
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[5:].partition('/')
+        return S3Storage(bucket, prefix, os.environ.get('SCRAPENHL_S3_ENDPOINT'))
+    return LocalStorage(url)
+
+
+def push_files(store, keys):
+    """
+    Uploads files from SAVE_FOLDER to the store
+
+    Parameters
+    -----------
+    store : LocalStorage or S3Storage
+        The result of get_storage
+    keys : iterable of str
+        Paths relative to SAVE_FOLDER
+    """
+    import os.path
+    for key in keys:
+        filename = scrapenhl_globals.SAVE_FOLDER + key
+        if os.path.exists(filename):
+            store.upload_file(filename, key)
+
+
+def pull_files(store, prefix = '', force_overwrite = False):
+    """
+    Downloads files from the store into SAVE_FOLDER
+
+    Parameters
+    -----------
+    store : LocalStorage or S3Storage
+        The result of get_storage
+    prefix : str
+        Only keys starting with this, e.g. '2016/'
+    force_overwrite : bool
+        If False, files already in SAVE_FOLDER are not downloaded again
+    """
+    import os.path
+    for key in store.list_keys(prefix):
+        filename = scrapenhl_globals.SAVE_FOLDER + key
+        if force_overwrite or not os.path.exists(filename):
+            store.download_file(key, filename)
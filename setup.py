@@ -7,7 +7,7 @@ setup(name = 'scrapenhl',
       author = 'Muneeb Alam',
       author_email = 'muneeb.alam@gmail.com',
       license = 'MIT',
-      packages = ['scrapenhl'],
+      packages = ['scrapenhl', 'scrapenhl.scrape', 'scrapenhl.manipulate'],
       install_requires=[
             'pandas',
             'numpy',
@@ -0,0 +1,90 @@
+"""
+Shared setup for the tests: a temporary SAVE_FOLDER, and small synthetic games written in the NHL API's json format.
+"""
+
+import os
+import sys
+import tempfile
+
+### Must be set before scrapenhl is imported, since scrapenhl_globals reads it at import time
+os.environ['SCRAPENHL_SAVE_FOLDER'] = tempfile.mkdtemp(prefix = 'scrapenhl_test_')
+os.environ.pop('SCRAPENHL_SHARD', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+HOME = {'id': 15, 'abbreviation': 'WSH', 'name': 'Washington Capitals'}
+ROAD = {'id': 3, 'abbreviation': 'NYR', 'name': 'New York Rangers'}
+
+
+def make_shift(playerid, team, period, start, end):
+    """
+    Returns one entry of shift_page['data']. start and end are 'MM:SS' within the period.
+    """
+    return {'playerId': playerid, 'teamAbbrev': team, 'period': period, 'startTime': start, 'endTime': end}
+
+
+def make_player(playerid, name, pos, num):
+    return {'person': {'id': playerid, 'fullName': name, 'shootsCatches': 'L'}, 'position': {'code': pos},
+            'jerseyNumber': str(num)}
+
+
+def make_game_json(season, game, homeplayers, roadplayers, goals = ()):
+    """
+    Returns a minimal game json. homeplayers and roadplayers are lists of (id, name, pos, #); goals are
+    (period, 'MM:SS', home score after, road score after).
+    """
+    def team(info, players, score):
+        return {'team': {'id': info['id']}, 'coaches': [],
+                'teamStats': {'teamSkaterStats': {'goals': score}},
+                'players': {'ID{0:d}'.format(p[0]): make_player(*p) for p in players}}
+
+    plays = [{'result': {'eventTypeId': 'GOAL'},
+              'about': {'period': period, 'periodType': 'REGULAR', 'periodTime': time,
+                        'goals': {'home': hscore, 'away': rscore}}}
+             for period, time, hscore, rscore in goals]
+    hfinal = goals[-1][2] if len(goals) > 0 else 0
+    rfinal = goals[-1][3] if len(goals) > 0 else 0
+    return {'gameData': {'game': {'pk': int('{0:d}0{1:d}'.format(season, game))},
+                         'datetime': {'dateTime': '{0:d}-10-13T23:00:00Z'.format(season)},
+                         'venue': {'name': 'Test Arena'},
+                         'teams': {'home': HOME, 'away': ROAD}},
+            'liveData': {'boxscore': {'teams': {'home': team(HOME, homeplayers, hfinal),
+                                                'away': team(ROAD, roadplayers, rfinal)}},
+                         'plays': {'allPlays': plays}}}
+
+
+def write_game(season, game, gamejson, shifts):
+    """
+    Saves a game json and shift list where scrape_game.scrape_game would, and registers the two teams in TEAM_IDS
+    """
+    import json
+    import zlib
+    import pandas as pd
+    from scrapenhl.scrape import scrapenhl_globals, scrape_game
+    os.makedirs(scrapenhl_globals.get_season_folder(season), exist_ok = True)
+    for filename, page in ((scrape_game.get_json_save_filename(season, game), gamejson),
+                           (scrape_game.get_shift_save_filename(season, game), {'data': shifts})):
+        with open(filename, 'wb') as w:
+            w.write(zlib.compress(json.dumps(page).encode('latin-1')))
+    teams = pd.DataFrame({'ID': [HOME['id'], ROAD['id']], 'Abbreviation': [HOME['abbreviation'], ROAD['abbreviation']],
+                          'Name': [HOME['name'], ROAD['name']]})
+    scrapenhl_globals.TEAM_IDS = pd.concat([scrapenhl_globals.TEAM_IDS, teams]).drop_duplicates(subset = 'ID')
+
+
+def make_simple_game(season, game):
+    """
+    Writes a one-period game: a goalie and five skaters per team on for the whole period, and one home goal
+    """
+    home = [(8470000 + i, 'Home Player{0:d}'.format(i), 'G' if i == 0 else 'C', i + 1) for i in range(6)]
+    road = [(8480000 + i, 'Road Player{0:d}'.format(i), 'G' if i == 0 else 'D', i + 1) for i in range(6)]
+    shifts = [make_shift(p[0], HOME['abbreviation'], 1, '00:00', '20:00') for p in home]
+    shifts += [make_shift(p[0], ROAD['abbreviation'], 1, '00:00', '20:00') for p in road]
+    write_game(season, game, make_game_json(season, game, home, road, [(1, '10:00', 1, 0)]), shifts)
+    return home, road
+
+
+@pytest.fixture
+def save_folder():
+    from scrapenhl.scrape import scrapenhl_globals
+    return scrapenhl_globals.SAVE_FOLDER
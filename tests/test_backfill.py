@@ -0,0 +1,24 @@
+import urllib.request
+
+import pytest
+
+from test_schedule import fake_urlopen, make_schedule_json
+
+
+def test_backfill_shard_needs_pushed_schedule(monkeypatch, tmp_path):
+    from scrapenhl.scrape import scrape_season, scrapenhl_globals, storage
+    store = storage.get_storage(str(tmp_path / 'store'))
+
+    monkeypatch.setattr(scrapenhl_globals, 'SHARD', '0')
+    with pytest.raises(ValueError, match = 'prepare_backfill'):
+        scrape_season.backfill_shard(2012, 0, 2, store)
+
+    monkeypatch.setattr(scrapenhl_globals, 'SHARD', None)
+    pages = {'requests': 0, 'json': make_schedule_json(2012, [(g, '2013-01-19', 'Final') for g in range(20001, 20006)])}
+    monkeypatch.setattr(urllib.request, 'urlopen', fake_urlopen(pages))
+    scrape_season.prepare_backfill(2012, store)
+    assert store.list_keys() == ['2012/schedule.feather']
+
+    ### Shards split the same schedule into contiguous, non-overlapping ranges
+    shards = [scrape_season.get_shard_games(2012, shard, 2, refresh = False) for shard in range(2)]
+    assert shards == [[20001, 20002, 20003], [20004, 20005]]
@@ -0,0 +1,27 @@
+import os
+
+from conftest import make_simple_game
+
+
+def test_import_shares_scrape_modules():
+    from scrapenhl.manipulate import chartmethods
+    from scrapenhl.scrape import scrapenhl_globals, scrape_game, season_aggregates
+    assert chartmethods.scrapenhl_globals is scrapenhl_globals
+    assert chartmethods.scrape_game is scrape_game
+    assert season_aggregates.scrapenhl_globals is scrapenhl_globals
+
+
+def test_render_one_game():
+    from scrapenhl.manipulate import chartmethods
+    make_simple_game(2016, 20001)
+
+    data = chartmethods.get_shift_chart_data(2016, 20001)
+    assert len(data['bars'].index) == 12
+    assert data['goals'] == [600]
+    assert data['h2h'].shape == (6, 6)
+
+    assert chartmethods.render_season_charts(2016, [20001], processes = 1) == 1
+    for chart in ('shifts', 'h2h'):
+        assert os.path.getsize(chartmethods.get_chart_filename(2016, 20001, chart)) > 0
+    ### Unchanged data is not rendered again
+    assert chartmethods.render_season_charts(2016, [20001], processes = 1) == 0
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+
+def test_failed_write_keeps_old_file(tmp_path):
+    from scrapenhl.scrape import fileio
+    filename = str(tmp_path / 'table.bin')
+    fileio.write_bytes(b'old', filename)
+
+    def writer(tmpname):
+        with open(tmpname, 'wb') as w:
+            w.write(b'partial')
+        raise IOError('disk full')
+
+    with pytest.raises(IOError):
+        fileio.atomic_write(filename, writer)
+    with open(filename, 'rb') as f:
+        assert f.read() == b'old'
+    assert sorted(os.listdir(str(tmp_path))) == ['table.bin', 'table.bin.lock']
+
+
+def test_nested_locks_are_counted_and_released(tmp_path):
+    from scrapenhl.scrape import fileio
+    filename = str(tmp_path / 'table.bin')
+    lockfile = fileio.get_lock_filename(filename)
+
+    with fileio.file_lock(filename):
+        assert fileio._HELD[lockfile][1] == 1
+        with fileio.file_lock(filename, shared = True):
+            with fileio.file_lock(filename):
+                assert fileio._HELD[lockfile][1] == 3
+            fileio.write_bytes(b'new', filename)
+            assert fileio._HELD[lockfile][1] == 2
+        assert fileio._HELD[lockfile][1] == 1
+    assert lockfile not in fileio._HELD
+
+    ### Released, so another descriptor can take it without blocking
+    if fileio.fcntl is not None:
+        fd = os.open(lockfile, os.O_RDWR)
+        try:
+            fileio.fcntl.flock(fd, fileio.fcntl.LOCK_EX | fileio.fcntl.LOCK_NB)
+        finally:
+            os.close(fd)
+
+
+def test_exclusive_inside_shared_raises(tmp_path):
+    from scrapenhl.scrape import fileio
+    filename = str(tmp_path / 'table.bin')
+    with fileio.file_lock(filename, shared = True):
+        with pytest.raises(RuntimeError):
+            with fileio.file_lock(filename):
+                pass
+        with fileio.file_lock(filename, shared = True):
+            assert fileio._HELD[fileio.get_lock_filename(filename)][1] == 2
+    assert fileio.get_lock_filename(filename) not in fileio._HELD
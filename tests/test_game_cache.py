@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def cache():
+    from scrapenhl.scrape import game_cache
+    oldmax = game_cache.MAX_CACHE_BYTES
+    game_cache.clear_cache()
+    yield game_cache
+    game_cache.set_max_cache_bytes(oldmax)
+    game_cache.clear_cache()
+
+
+def write_file(folder, name, text):
+    filename = str(folder / name)
+    with open(filename, 'w') as w:
+        w.write(text)
+    return filename
+
+
+def read_text(filename):
+    with open(filename) as f:
+        text = f.read()
+    return text, len(text)
+
+
+def test_hit_after_miss(cache, tmp_path):
+    filename = write_file(tmp_path, 'a.txt', 'abc')
+    assert cache.read_cached(2016, 20001, 'json', filename, read_text) == 'abc'
+    assert cache.read_cached(2016, 20001, 'json', filename, read_text) == 'abc'
+    stats = cache.get_cache_stats()
+    assert (stats['misses'], stats['hits'], stats['entries'], stats['bytes']) == (1, 1, 1, 3)
+
+
+def test_replaced_file_is_reread(cache, tmp_path):
+    filename = write_file(tmp_path, 'a.txt', 'abc')
+    assert cache.read_cached(2016, 20001, 'json', filename, read_text) == 'abc'
+    write_file(tmp_path, 'a.txt', 'abcdef')
+    assert cache.read_cached(2016, 20001, 'json', filename, read_text) == 'abcdef'
+    ### Same size, so only the mtime tells them apart
+    write_file(tmp_path, 'a.txt', 'ghijkl')
+    os.utime(filename, ns = (1, 1))
+    assert cache.read_cached(2016, 20001, 'json', filename, read_text) == 'ghijkl'
+    stats = cache.get_cache_stats()
+    assert (stats['misses'], stats['hits'], stats['entries'], stats['bytes']) == (3, 0, 1, 6)
+
+
+def test_least_recently_used_is_evicted(cache, tmp_path):
+    cache.set_max_cache_bytes(10)
+    files = {game: write_file(tmp_path, '{0:d}.txt'.format(game), 'xxxx') for game in (20001, 20002, 20003)}
+    cache.read_cached(2016, 20001, 'json', files[20001], read_text)
+    cache.read_cached(2016, 20002, 'json', files[20002], read_text)
+    ### Touching 20001 makes 20002 the oldest
+    cache.read_cached(2016, 20001, 'json', files[20001], read_text)
+    cache.read_cached(2016, 20003, 'json', files[20003], read_text)
+    assert list(cache._CACHE) == [(2016, 20001, 'json'), (2016, 20003, 'json')]
+    stats = cache.get_cache_stats()
+    assert (stats['evictions'], stats['bytes']) == (1, 8)
+
+    ### Too big to cache at all
+    big = write_file(tmp_path, 'big.txt', 'x' * 20)
+    assert cache.read_cached(2016, 20004, 'json', big, read_text) == 'x' * 20
+    assert len(cache._CACHE) == 2
+
+
+def test_invalidate_and_disable(cache, tmp_path):
+    filename = write_file(tmp_path, 'a.txt', 'abc')
+    for artifact in ('json', 'shifts'):
+        cache.read_cached(2016, 20001, artifact, filename, read_text)
+    cache.read_cached(2016, 20002, 'json', filename, read_text)
+
+    cache.invalidate(2016, 20001, 'shifts')
+    assert list(cache._CACHE) == [(2016, 20001, 'json'), (2016, 20002, 'json')]
+    cache.invalidate(2016, 20001)
+    assert list(cache._CACHE) == [(2016, 20002, 'json')]
+    assert cache.get_cache_stats()['bytes'] == 3
+
+    cache.set_max_cache_bytes(0)
+    stats = cache.get_cache_stats()
+    assert (stats['entries'], stats['bytes']) == (0, 0)
+    cache.read_cached(2016, 20002, 'json', filename, read_text)
+    assert cache.get_cache_stats()['entries'] == 0
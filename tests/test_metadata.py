@@ -0,0 +1,108 @@
+import os
+
+import pandas as pd
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'metadata')
+PEOPLE = [8471214, 8474651, 8476459]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    Replays recorded API responses and counts requests
+    """
+    from scrapenhl.scrape import metadata
+    metadata.set_fixture_folder(FIXTURES)
+    calls = []
+    fetch_json = metadata.fetch_json
+
+    def counting_fetch_json(url):
+        calls.append(url)
+        return fetch_json(url)
+    monkeypatch.setattr(metadata, 'fetch_json', counting_fetch_json)
+    for table in ('people', 'teams'):
+        if os.path.exists(metadata.get_metadata_filename(table)):
+            os.remove(metadata.get_metadata_filename(table))
+    yield calls
+    metadata.set_fixture_folder(None)
+
+
+def expire(table):
+    from scrapenhl.scrape import metadata
+    df = metadata.get_metadata(table)
+    metadata._write_metadata(table, df.assign(Fetched = df.Fetched - pd.Timedelta(days = 365)))
+
+
+def test_refresh_people_uses_cache_until_expiry(api):
+    from scrapenhl.scrape import metadata
+    people = metadata.refresh_people(PEOPLE)
+    assert len(api) == 1
+    row = people.set_index('ID').loc[8474651]
+    assert (row.Name, row.Pos, row.Hand, row['#']) == ('Braden Holtby', 'G', 'L', 70)
+
+    metadata.refresh_people(PEOPLE)
+    assert len(api) == 1
+
+    expire('people')
+    people = metadata.refresh_people(PEOPLE)
+    assert len(api) == 2
+    assert (people.Fetched > pd.Timestamp.now(tz = 'UTC') - pd.Timedelta(days = 1)).all()
+
+
+def test_refresh_teams_uses_cache_until_expiry(api):
+    from scrapenhl.scrape import metadata
+    teams = metadata.refresh_teams([15, 3])
+    assert dict(zip(teams.ID, teams.Abbreviation)) == {3: 'NYR', 15: 'WSH'}
+    assert len(api) == 1
+
+    metadata.refresh_teams([3])
+    assert len(api) == 1
+
+    expire('teams')
+    metadata.refresh_teams([15, 3])
+    assert len(api) == 2
+    metadata.refresh_teams([15, 3], force = True)
+    assert len(api) == 3
+
+
+def test_update_id_tables_from_metadata(api, monkeypatch):
+    from scrapenhl.scrape import metadata, scrapenhl_globals
+    monkeypatch.setattr(scrapenhl_globals, 'PLAYER_IDS', pd.DataFrame({
+        'ID': ['8471214', '8474651', '8476459', '8476459'], 'Name': ['Alexander Ovechkin', 'Braden Holtby',
+                                                                     'Mika Zibanejad', 'Mika Zibanajed'],
+        'Team': ['WSH', 'WSH', 'OTT', 'NYR'], 'Pos': ['L', 'G', 'C', 'C'], '#': [8, 70, 93, 93],
+        'Hand': ['N/A', 'L', 'L', 'L']}))
+    monkeypatch.setattr(scrapenhl_globals, 'TEAM_IDS', pd.DataFrame({'ID': [15, 3], 'Abbreviation': ['WSH', 'NYR'],
+                                                                     'Name': ['Washington', 'New York Rangers']}))
+    metadata.update_id_tables_from_metadata()
+
+    players = scrapenhl_globals.PLAYER_IDS
+    assert dict(zip(players.ID, players.Name)) == {'8471214': 'Alex Ovechkin', '8474651': 'Braden Holtby',
+                                                   '8476459': 'Mika Zibanejad'}
+    ### Per-game team is kept
+    assert sorted(players.Team[players.ID == '8476459']) == ['NYR', 'OTT']
+    assert players.Hand[players.ID == '8471214'].iloc[0] == 'R'
+    assert dict(zip(scrapenhl_globals.TEAM_IDS.ID, scrapenhl_globals.TEAM_IDS.Name)) == {
+        15: 'Washington Capitals', 3: 'New York Rangers'}
+    assert len(api) == 2
+
+
+def test_rebuild_player_id_file_keeps_corrections(api):
+    from conftest import HOME, ROAD, make_game_json, make_shift, write_game
+    from scrapenhl.scrape import metadata, scrape_season, scrapenhl_globals
+    home = [(8474651, 'Braden Holtby', 'G', 70), (8471214, 'Alexander Ovechkin', 'L', 8)]
+    road = [(8476459, 'Mika Zibanajed', 'C', 93)]
+    shifts = [make_shift(p[0], HOME['abbreviation'], 1, '00:00', '20:00') for p in home]
+    shifts += [make_shift(p[0], ROAD['abbreviation'], 1, '00:00', '20:00') for p in road]
+    write_game(2009, 20001, make_game_json(2009, 20001, home, road), shifts)
+    scrape_season.parse_games(2009, [20001])
+    metadata.refresh_people(PEOPLE)
+
+    scrape_season.rebuild_player_id_file([2009])
+    players = scrapenhl_globals.PLAYER_IDS
+    assert dict(zip(players.ID, players.Name)) == {'8471214': 'Alex Ovechkin', '8474651': 'Braden Holtby',
+                                                   '8476459': 'Mika Zibanejad'}
+    assert players.Pos[players.ID == '8471214'].iloc[0] == 'L'
+    ### The cache is used as is
+    assert len(api) == 1
@@ -0,0 +1,36 @@
+from conftest import make_simple_game
+
+
+def test_parsed_games_are_not_stale():
+    from scrapenhl.scrape import scrape_game, scrape_season
+    games = [20101, 20102]
+    for game in games:
+        make_simple_game(2015, game)
+
+    assert len(scrape_season.parse_games(2015, games).index) == 4
+    stale = scrape_season.parse_games(2015, games, dry_run = True)
+    assert len(stale.index) == 0
+    for game in games:
+        for stage in scrape_game.PARSER_VERSIONS:
+            assert scrape_game.get_parsed_stage_status(2015, game, stage) == 'current'
+
+
+def test_stage_version_bump_makes_games_stale(monkeypatch):
+    from scrapenhl.scrape import scrape_game, scrape_season
+    make_simple_game(2015, 20103)
+    scrape_season.parse_games(2015, [20103])
+
+    monkeypatch.setitem(scrape_game.PARSER_VERSIONS, 'pbp', scrape_game.PARSER_VERSIONS['pbp'] + 1)
+    stale = scrape_season.get_stale_games(2015, [20103])
+    assert list(zip(stale.Stage, stale.Status)) == [('pbp', 'old version')]
+
+
+def test_shifts_without_game_json_stay_missing():
+    import os
+    from scrapenhl.scrape import scrape_game
+    make_simple_game(2015, 20104)
+    os.remove(scrape_game.get_json_save_filename(2015, 20104))
+
+    scrape_game.parse_game(2015, 20104, stages = ['shifts'])
+    assert not os.path.exists(scrape_game.get_parsed_shifts_save_filename(2015, 20104))
+    assert scrape_game.get_parsed_stage_status(2015, 20104, 'shifts') == 'missing'
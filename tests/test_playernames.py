@@ -0,0 +1,36 @@
+import os
+
+import pandas as pd
+
+
+def make_variants(rows):
+    return pd.DataFrame(rows, columns = ['ID', 'Name', 'Games', 'LastGame'])
+
+
+def test_partial_variants_keep_other_names():
+    from scrapenhl.scrape import scrapenhl_globals
+    filename = scrapenhl_globals.CORRECTED_PLAYERNAMES_FILE
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    scrapenhl_globals.write_correct_playername_file(variants = make_variants([
+        ['1', 'Alex Ovechkin', 10, 201520001],
+        ['2', 'Henrik Lundqvist', 10, 201520001],
+        ['3', 'Nicklas Backstrom', 10, 201520001]]))
+
+    ### A manual correction, as a user would add by hand
+    names = pd.read_csv(filename, dtype = {'ID': str}, encoding = 'latin-1')
+    names.loc[names.ID == '3', ['Name', 'Manual']] = ['Nick Backstrom', 1]
+    names.to_csv(filename, index = False, encoding = 'latin-1')
+
+    ### A later call covering only one player's seasons
+    scrapenhl_globals.write_correct_playername_file(rule = 'most_recent', variants = make_variants([
+        ['1', 'Alexander Ovechkin', 1, 201620001],
+        ['1', 'Alex Ovechkin', 3, 201610001],
+        ['3', 'Nicklas Backstrom', 3, 201620001]]))
+
+    names = pd.read_csv(filename, dtype = {'ID': str}, encoding = 'latin-1')
+    assert list(names.ID) == ['1', '2', '3']
+    assert dict(zip(names.ID, names.Name)) == {'1': 'Alexander Ovechkin', '2': 'Henrik Lundqvist',
+                                               '3': 'Nick Backstrom'}
+    assert list(names.Manual) == [0, 0, 1]
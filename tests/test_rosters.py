@@ -0,0 +1,25 @@
+import os
+
+from conftest import make_simple_game
+
+
+def test_season_rosters_grow_as_games_are_parsed():
+    from scrapenhl.scrape import scrape_season, scrapenhl_globals
+    make_simple_game(2014, 20001)
+    scrape_season.parse_games(2014, [20001])
+    assert os.path.exists(scrape_season.get_season_rosters_filename(2014))
+    assert sorted(set(scrape_season.get_season_rosters(2014).Game)) == [20001]
+
+    make_simple_game(2014, 20002)
+    scrape_season.parse_games(2014, [20002])
+    rosters = scrape_season.get_season_rosters(2014)
+    assert sorted(set(rosters.Game)) == [20001, 20002]
+    assert len(rosters.index) == 24
+
+    scrape_season.rebuild_player_id_file([2014])
+    assert set(scrapenhl_globals.PLAYER_IDS.ID) == set(rosters.ID)
+    assert len(scrapenhl_globals.PLAYER_IDS.index) == 12
+
+    variants = scrape_season.get_name_variants([2014])
+    assert set(variants.Games) == {2}
+    assert set(variants.LastGame) == {201420002}
@@ -0,0 +1,52 @@
+import io
+import json
+import urllib.request
+
+import pandas as pd
+
+
+def make_schedule_json(season, games):
+    """
+    games are (game, date, status)
+    """
+    dates = {}
+    for game, date, status in games:
+        dates.setdefault(date, []).append({'gamePk': int('{0:d}0{1:d}'.format(season, game)), 'gameType': 'R',
+                                           'status': {'abstractGameState': status},
+                                           'teams': {'home': {'team': {'id': 15}}, 'away': {'team': {'id': 3}}}})
+    return {'dates': [{'date': date, 'games': g} for date, g in sorted(dates.items())]}
+
+
+def fake_urlopen(pages):
+    def urlopen(url):
+        pages['requests'] += 1
+        return io.BytesIO(json.dumps(pages['json']).encode('latin-1'))
+    return urlopen
+
+
+def test_schedule_needs_refresh():
+    from scrapenhl.scrape import scrape_season
+    schedule = pd.DataFrame({'Game': [20001, 20002], 'Date': ['2016-10-12', '2016-10-13'],
+                             'Status': ['Final', 'Preview']})
+    assert not scrape_season.schedule_needs_refresh(schedule, today = '2016-10-12')
+    assert scrape_season.schedule_needs_refresh(schedule, today = '2016-10-13')
+
+
+def test_cached_schedule_refreshes_only_while_games_are_pending(monkeypatch):
+    from scrapenhl.scrape import scrape_season
+    pages = {'requests': 0, 'json': make_schedule_json(2013, [(20001, '2013-10-01', 'Final'),
+                                                             (20002, '2013-10-02', 'Preview')])}
+    monkeypatch.setattr(urllib.request, 'urlopen', fake_urlopen(pages))
+
+    assert scrape_season.get_scheduled_games(2013, final_only = True) == [20001]
+    assert pages['requests'] == 1
+    ### Game 20002 was not final when fetched, so the next call fetches again and picks up the result and a new game
+    pages['json'] = make_schedule_json(2013, [(20001, '2013-10-01', 'Final'), (20002, '2013-10-02', 'Final'),
+                                              (30111, '2014-04-16', 'Final')])
+    assert scrape_season.get_scheduled_games(2013, final_only = True) == [20001, 20002, 30111]
+    assert pages['requests'] == 2
+    ### Everything is final now, so the saved schedule is used
+    scrape_season.get_scheduled_games(2013)
+    assert pages['requests'] == 2
+    scrape_season.get_scheduled_games(2013, refresh = True)
+    assert pages['requests'] == 3
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from conftest import make_simple_game
+
+
+def test_incremental_totals_match_rebuild():
+    from scrapenhl.scrape import scrape_season, season_aggregates
+    for game in (20001, 20002):
+        make_simple_game(2011, game)
+    scrape_season.parse_games(2011, [20001, 20002])
+    ### Reparsing replaces the game's totals instead of adding them again
+    scrape_season.parse_games(2011, [20002], force_overwrite = True)
+    incremental = {name: df.copy() for name, df in season_aggregates.get_season_aggregates(2011).items()}
+
+    player = incremental['player']
+    assert set(player.GP) == {2}
+    assert set(player.TOI) == {2400}
+    assert set(player.TOI5v5) == {2400}
+    assert list(incremental['games'].Game) == [20001, 20002]
+
+    season_aggregates.rebuild_season_aggregates(2011)
+    for name, df in season_aggregates.get_season_aggregates(2011).items():
+        pd.testing.assert_frame_equal(df, incremental[name], check_like = True)
+
+
+def test_tables_are_reread_after_another_process_writes():
+    from scrapenhl.scrape import scrape_season, scrapenhl_globals, season_aggregates
+    for game in (20001, 20002):
+        make_simple_game(2010, game)
+    scrapenhl_globals.write_team_id_file()
+    scrape_season.parse_games(2010, [20001])
+    assert list(season_aggregates.get_season_aggregates(2010)['games'].Game) == [20001]
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', 'from scrapenhl.scrape import scrape_season; '
+                                          'scrape_season.parse_games(2010, [20002])'],
+                   cwd = root, env = dict(os.environ, PYTHONPATH = root), check = True)
+
+    assert season_aggregates.is_game_included(2010, 20002)
+    assert set(season_aggregates.get_season_aggregates(2010)['player'].GP) == {2}
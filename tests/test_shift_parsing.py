@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from conftest import make_shift
+
+
+def get_synthetic_shifts():
+    """
+    One period plus a goalie shift that crosses from the 2nd period into the 3rd, with a duplicate shift, an overlapping
+    shift, six home skaters at once, and a zero-length entry
+    """
+    shifts = [make_shift(1, 'WSH', 1, '00:00', '20:00')]
+    shifts += [make_shift(p, 'WSH', 1, '00:00', '01:00') for p in (11, 12, 13, 14, 15)]
+    shifts += [make_shift(11, 'WSH', 1, '00:00', '01:00'),    # duplicate
+               make_shift(12, 'WSH', 1, '00:30', '01:30'),    # overlaps the previous shift
+               make_shift(16, 'WSH', 1, '00:30', '01:00'),    # sixth skater
+               make_shift(17, 'WSH', 1, '00:40', '00:40'),    # zero length
+               make_shift(11, 'WSH', 1, '02:00', '03:00')]
+    shifts += [make_shift(2, 'NYR', 1, '00:00', '20:00'),
+               make_shift(2, 'NYR', 2, '19:30', '00:30')]     # ends in the 3rd period
+    shifts += [make_shift(p, 'NYR', 1, '00:00', '01:00') for p in (21, 22, 23, 24, 25)]
+    return shifts
+
+
+@pytest.fixture
+def toi():
+    from scrapenhl.scrape import scrape_game
+    return scrape_game.read_shifts_from_json(get_synthetic_shifts(), 'WSH', 'NYR')
+
+
+def test_intervals():
+    from scrapenhl.scrape import scrape_game
+    intervals = scrape_game.read_shift_intervals_from_json(get_synthetic_shifts(), 'WSH', 'NYR')
+    shifts = {(p, s, e) for p, s, e in zip(intervals.PlayerID, intervals.Start, intervals.End)}
+    assert (12, 0, 89) in shifts
+    assert (11, 0, 59) in shifts and (11, 120, 179) in shifts
+    assert (2, 2370, 2429) in shifts
+    assert 17 not in set(intervals.PlayerID)
+    assert list(intervals.Team.unique()) == ['WSH', 'NYR']
+    assert len(intervals.index) == 15
+
+
+def test_grid_columns(toi):
+    assert list(toi.columns) == ['Time'] + ['WSH{0:d}'.format(i) for i in range(1, 8)] + \
+                                ['NYR{0:d}'.format(i) for i in range(1, 7)]
+    assert list(toi.Time) == list(range(2430))
+
+
+def test_grid_contents(toi):
+    home = toi[['WSH{0:d}'.format(i) for i in range(1, 8)]].to_numpy()
+    road = toi[['NYR{0:d}'.format(i) for i in range(1, 7)]].to_numpy()
+
+    ### Each player is on the ice at most once per second, for the merged length of their shifts
+    for player, seconds in ((1, 1200), (11, 120), (12, 90), (16, 30)):
+        perrow = (home == player).sum(axis = 1)
+        assert perrow.max() == 1
+        assert perrow.sum() == seconds
+    assert (home == 17).sum() == 0
+
+    ### Goalie and six skaters at once
+    assert (~np.isnan(home[30:60])).sum(axis = 1).tolist() == [7] * 30
+    assert (~np.isnan(home[:30])).sum(axis = 1).tolist() == [6] * 30
+
+    ### The period-crossing goalie shift runs to its end in the next period
+    assert (road[2370:2430] == 2).any(axis = 1).all()
+    assert not (road[1200:2370] == 2).any()
+
+
+def test_slots_are_stable(toi):
+    ### A shift keeps its slot for its whole length, and a freed slot is reused by the next shift
+    assert (toi.WSH1[:1200] == 1).all()
+    assert (toi.WSH3[:90] == 12).all()
+    assert (toi.WSH7[30:60] == 16).all()
+    assert (toi.WSH2[:60] == 11).all() and (toi.WSH2[120:180] == 11).all()
+    assert toi.NYR1.dropna().unique().tolist() == [2]
+
+
+def test_game_state(toi):
+    import pandas as pd
+    from scrapenhl.scrape import scrape_game
+    goals = pd.DataFrame({'Time': [45], 'HomeScore': [1], 'RoadScore': [0]})
+    state = scrape_game.add_game_state_to_toi(toi, 'WSH', 'NYR', {1, 2}, goals)
+    assert state.Strength[10] == 55
+    assert state.Strength[45] == 65
+    ### Score is the score before any goal at this second
+    assert state.HomeScore[45] == 0 and state.HomeScore[46] == 1
+    assert state.RoadGoaliePulled[2400] == 0
@@ -0,0 +1,69 @@
+from conftest import HOME, ROAD, make_game_json, make_shift, make_simple_game, write_game
+
+
+def make_crowded_game(season, game):
+    """
+    Writes a game where the home team has ten players on at once, more than TOILOG_SLOTS per team
+    """
+    home = [(8470100 + i, 'Extra Player{0:d}'.format(i), 'G' if i == 0 else 'C', i + 1) for i in range(10)]
+    road = [(8480100 + i, 'Other Player{0:d}'.format(i), 'G' if i == 0 else 'D', i + 1) for i in range(6)]
+    shifts = [make_shift(p[0], HOME['abbreviation'], 1, '00:00', '20:00') for p in home]
+    shifts += [make_shift(p[0], ROAD['abbreviation'], 1, '00:00', '20:00') for p in road]
+    write_game(season, game, make_game_json(season, game, home, road), shifts)
+
+
+def count_batches(filename):
+    import pyarrow as pa
+    with pa.memory_map(filename) as source:
+        return pa.ipc.open_file(source).num_record_batches
+
+
+def test_update_teamlogs_streams_and_appends():
+    from scrapenhl.scrape import scrape_game, scrape_season
+    games = [20001, 20002, 20003]
+    for game in games:
+        make_simple_game(2008, game)
+    scrape_season.parse_games(2008, games[:2])
+
+    ### A tiny buffer flushes every game as its own batch
+    scrape_season.update_teamlogs(2008, max_buffer_bytes = 1)
+    for team in ('WSH', 'NYR'):
+        log = scrape_season.get_team_toilog(2008, team)
+        assert list(log.columns) == scrape_season.get_toilog_schema(team).names
+        assert sorted(set(log.Game)) == [20001, 20002]
+        assert len(log.index) == 2 * len(scrape_game.get_parsed_shifts(2008, 20001).index)
+        assert count_batches(scrape_season.get_team_toilog_filename(2008, team)) == 2
+    wsh = scrape_season.get_team_toilog(2008, 'WSH')
+    assert set(wsh.Strength) == {55}
+    assert wsh.WSH6.notnull().all() and wsh.WSH7.isnull().all()
+
+    ### Only the newly parsed game is added
+    scrape_season.parse_games(2008, games[2:])
+    scrape_season.update_teamlogs(2008, max_buffer_bytes = 1)
+    log = scrape_season.get_team_toilog(2008, 'NYR')
+    assert log.groupby('Game').size().to_dict() == {game: len(wsh.index) // 2 for game in games}
+
+    ### Rebuilding from scratch gives the same log
+    scrape_season.update_teamlogs(2008, force_overwrite = True)
+    assert scrape_season.get_team_toilog(2008, 'NYR').equals(log)
+
+
+def test_update_teamlogs_widens_for_crowded_games():
+    from scrapenhl.scrape import scrape_season
+    make_simple_game(2007, 20001)
+    scrape_season.parse_games(2007, [20001])
+    scrape_season.update_teamlogs(2007)
+    assert 'WSH9' not in scrape_season.get_team_toilog(2007, 'WSH').columns
+
+    make_crowded_game(2007, 20002)
+    scrape_season.parse_games(2007, [20002])
+    scrape_season.update_teamlogs(2007)
+    wsh = scrape_season.get_team_toilog(2007, 'WSH')
+    nyr = scrape_season.get_team_toilog(2007, 'NYR')
+    assert list(wsh.columns) == scrape_season.get_toilog_schema('WSH', 10).names
+    assert list(nyr.columns) == scrape_season.get_toilog_schema('NYR', 10).names
+    crowded = wsh[wsh.Game == 20002]
+    assert crowded.WSH10.notnull().all() and set(crowded.Strength) == {95}
+    assert nyr[nyr.Game == 20002].Opp10.notnull().all()
+    ### The earlier game was copied over with empty extra slots
+    assert wsh[wsh.Game == 20001].WSH9.isnull().all()